@@ -1,74 +1,116 @@
+import csv
 import tarfile
 import requests
 import gzip
 import shutil
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
+import numpy as np
 import pandas as pd
 import logging
 import os
+from contextlib import contextmanager
 from src.utils.utils import check_path_exists
+from src.data.passages import PassageIndex
 
 LOGGER = logging.getLogger('cli')
 
-
-def download_dataset(datasets: list = None, path: str = "data/TREC_Passage"):
+LINKS = {
+    'collection.tsv': "https://msmarco.blob.core.windows.net/msmarcoranking/collection.tar.gz",
+    'queries.train.tsv': "https://msmarco.blob.core.windows.net/msmarcoranking/queries.tar.gz",
+    'qrels.train.tsv': "https://msmarco.blob.core.windows.net/msmarcoranking/qrels.train.tsv",
+    'qidpidtriples.train.full.2.tsv': 'https://msmarco.blob.core.windows.net/msmarcoranking/qidpidtriples.train.full.2.tsv.gz',
+    'msmarco-test2019-queries.tsv': 'https://msmarco.blob.core.windows.net/msmarcoranking/msmarco-test2019-queries.tsv.gz',
+    'msmarco-test2020-queries.tsv': 'https://msmarco.blob.core.windows.net/msmarcoranking/msmarco-test2020-queries.tsv.gz',
+    '2019qrels-pass.txt': 'https://trec.nist.gov/data/deep/2019qrels-pass.txt',
+    '2020qrels-pass.txt': 'https://trec.nist.gov/data/deep/2020qrels-pass.txt'
+}
+
+ARCHIVES = {
+    'collection.tsv': 'collection.tar.gz',
+    'queries.train.tsv': 'queries.tar.gz',
+    'qrels.train.tsv': 'qrels.train.tsv',
+    'qidpidtriples.train.full.2.tsv': 'qidpidtriples.train.full.2.tsv.gz',
+    'msmarco-test2019-queries.tsv': 'msmarco-test2019-queries.tsv.gz',
+    'msmarco-test2020-queries.tsv': 'msmarco-test2020-queries.tsv.gz',
+    '2019qrels-pass.txt': '2019qrels-pass.txt',
+    '2020qrels-pass.txt': '2020qrels-pass.txt'
+}
+
+# Pinned sha256 digests of downloaded files per dataset. Digests of files downloaded before are recorded in
+# "checksums.json" of the dataset directory and verify later downloads of the same file.
+CHECKSUMS = {}
+
+
+def download_dataset(datasets: list = None, path: str = "data/TREC_Passage", workers: int = 4,
+                     checksums: dict = None, extract: bool = True):
     """ Combines and executes download and unzip methods
 
+    Missing archives are downloaded concurrently, interrupted downloads are resumed.
+
     Args:
         datasets (list): List of required files
         path (str): Location to store downloaded data.
+        workers (int): Number of concurrent downloads
+        checksums (dict): Expected sha256 hex digest of the downloaded file per dataset, CHECKSUMS and the digests
+            recorded in "checksums.json" of path are used for datasets not contained
+        extract (bool): Whether archives are unpacked, see open_dataset to read them without unpacking
 
     Returns:
         none
     """
     assert datasets is not None, "No dataset selected"
 
-    links = {
-        'collection.tsv': "https://msmarco.blob.core.windows.net/msmarcoranking/collection.tar.gz",
-        'queries.train.tsv': "https://msmarco.blob.core.windows.net/msmarcoranking/queries.tar.gz",
-        'qrels.train.tsv': "https://msmarco.blob.core.windows.net/msmarcoranking/qrels.train.tsv",
-        'qidpidtriples.train.full.2.tsv': 'https://msmarco.blob.core.windows.net/msmarcoranking/qidpidtriples.train.full.2.tsv.gz',
-        'msmarco-test2019-queries.tsv': 'https://msmarco.blob.core.windows.net/msmarcoranking/msmarco-test2019-queries.tsv.gz',
-        'msmarco-test2020-queries.tsv': 'https://msmarco.blob.core.windows.net/msmarcoranking/msmarco-test2020-queries.tsv.gz',
-        '2019qrels-pass.txt': 'https://trec.nist.gov/data/deep/2019qrels-pass.txt',
-        '2020qrels-pass.txt': 'https://trec.nist.gov/data/deep/2020qrels-pass.txt'
-    }
-
-    zip_links = {
-        'collection.tsv': 'collection.tar.gz',
-        'queries.train.tsv': 'queries.tar.gz',
-        'qrels.train.tsv': 'qrels.train.tsv',
-        'qidpidtriples.train.full.2.tsv': 'qidpidtriples.train.full.2.tsv.gz',
-        'msmarco-test2019-queries.tsv': 'msmarco-test2019-queries.tsv.gz',
-        'msmarco-test2020-queries.tsv': 'msmarco-test2020-queries.tsv.gz',
-        '2019qrels-pass.txt': '2019qrels-pass.txt',
-        '2020qrels-pass.txt': '2020qrels-pass.txt'
-    }
-
     check_path_exists(path)
-
+    recorded_path = os.path.join(path, 'checksums.json')
+    recorded = {}
+    if os.path.exists(recorded_path):
+        with open(recorded_path) as file:
+            recorded = json.load(file)
+    checksums = {**recorded, **CHECKSUMS, **({} if checksums is None else checksums)}
+
+    pending = []
     for dataset in datasets:
         filepath = os.path.join(path, dataset)
-        zippath = os.path.join(path, zip_links[dataset])
+        zippath = os.path.join(path, ARCHIVES[dataset])
 
         if (not os.path.exists(zippath) and not os.path.exists(filepath)):
-            download(links[dataset], path)
+            pending.append(dataset)
         else:
             LOGGER.debug(f'{dataset} archive already exists')
 
-        unzip(os.path.join(path, zip_links[dataset])) if not os.path.exists(filepath) else LOGGER.debug(
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pending)))) as executor:
+        futures = {dataset: executor.submit(download, LINKS[dataset], path, checksums.get(dataset))
+                   for dataset in pending}
+        for dataset, future in futures.items():
+            recorded[dataset] = future.result()
+
+    if len(pending) > 0:
+        with open(recorded_path, 'w') as file:
+            json.dump(recorded, file, indent=2)
+
+    for dataset in datasets if extract else []:
+        filepath = os.path.join(path, dataset)
+        unzip(os.path.join(path, ARCHIVES[dataset])) if not os.path.exists(filepath) else LOGGER.debug(
             f'{dataset} already exists')
 
 
-def download(remote_url: str = None, path: str = None):
+def download(remote_url: str = None, path: str = None, checksum: str = None, block_size: int = 2 ** 20):
     """ Downloads files
 
+    The data is written to "<file>.part" first. If such a partial file exists, only the missing bytes are
+    requested with a range request. The file is renamed once its size and checksum have been verified.
+
     Args:
         remote_url (str): URL to dataset
         path (str): Location to store downloaded data.
+        checksum (str): Expected sha256 hex digest of the file, not checked if None
+        block_size (int): Number of bytes read and written at once
 
     Returns:
-        none
+        (str): sha256 hex digest of the downloaded file
 
     """
     assert remote_url is not None, "No URL given"
@@ -76,24 +118,52 @@ def download(remote_url: str = None, path: str = None):
 
     file_name = remote_url.rsplit("/", 1)[-1]
     file_path = os.path.join(path, file_name)
-
-    LOGGER.info("Start Downloading Data")
-    response = requests.get(remote_url, stream=True)
-    total_bytesize = int(response.headers.get('content-length', 0))
-    block_size = 8192
-    progress_bar = tqdm(total=total_bytesize, unit='iB', unit_scale=True)
-
-    with open(file_path, "wb") as file:
-        for data in response.iter_content(block_size):
-            progress_bar.update(len(data))
-            file.write(data)
-    progress_bar.close()
+    part_path = file_path + '.part'
+    position = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+    LOGGER.info(f"Start Downloading {file_name}")
+    with requests.get(remote_url, stream=True, timeout=60,
+                      headers={'Range': f'bytes={position}-'} if position > 0 else None) as response:
+        if response.status_code == 416 and position > 0:
+            total_bytesize = int(response.headers.get('content-range', '*/-1').rsplit('/', 1)[-1])
+            if total_bytesize != position:
+                LOGGER.warning(f'{part_path} does not match the remote file, restarting download')
+                os.remove(part_path)
+                return download(remote_url, path, checksum, block_size)
+            LOGGER.debug(f'{file_name} already downloaded completely')
+        else:
+            response.raise_for_status()
+            if response.status_code == 206:
+                LOGGER.info(f'Resuming {file_name} at byte {position}')
+                total_bytesize = int(response.headers.get('content-range', '*/0').rsplit('/', 1)[-1])
+            else:
+                position = 0
+                total_bytesize = int(response.headers.get('content-length', 0))
+
+            progress_bar = tqdm(total=total_bytesize, initial=position, unit='iB', unit_scale=True)
+            with open(part_path, "ab" if position > 0 else "wb", buffering=block_size) as file:
+                for data in response.iter_content(block_size):
+                    progress_bar.update(len(data))
+                    file.write(data)
+            progress_bar.close()
     LOGGER.info("Downloading finished")
 
-    if total_bytesize != 0 and progress_bar.n != total_bytesize:
+    if total_bytesize != 0 and os.path.getsize(part_path) != total_bytesize:
         LOGGER.error("Something went wrong while downloading")
         raise FileExistsError
 
+    digest = hashlib.sha256()
+    with open(part_path, 'rb') as file:
+        for data in iter(lambda: file.read(block_size), b''):
+            digest.update(data)
+    if checksum is not None and digest.hexdigest() != checksum:
+        os.remove(part_path)
+        LOGGER.error(f"Checksum of {file_name} does not match")
+        raise IOError(f'Checksum mismatch for {file_name}')
+
+    os.replace(part_path, file_path)
+    return digest.hexdigest()
+
 
 def unzip(file: str = None):
     """ Unzips files
@@ -125,6 +195,56 @@ def unzip(file: str = None):
         LOGGER.info("unzipping successful")
 
 
+@contextmanager
+def open_dataset(dataset: str, path: str = "data/TREC_Passage"):
+    """ Opens a dataset for reading, decompressing it on the fly from its archive if it is not unpacked.
+
+    Missing datasets are downloaded without unpacking, .gz files and .tar.gz members are streamed, so every byte
+    is read once and no uncompressed copy is written to disk.
+
+    Args:
+        dataset (str): Name of the dataset, e.g. "collection.tsv"
+        path (str): Location of dataset
+
+    Returns:
+        (file): Binary file object of the dataset
+
+    """
+    filepath = os.path.join(path, dataset)
+    archive = os.path.join(path, ARCHIVES[dataset])
+    if not os.path.exists(filepath) and not os.path.exists(archive):
+        LOGGER.debug("File not there, downloading a new one")
+        download_dataset([dataset], path, extract=False)
+
+    if os.path.exists(filepath):
+        with open(filepath, 'rb') as file:
+            yield file
+    elif archive.endswith('.tar.gz'):
+        with tarfile.open(archive, 'r:gz') as tar:
+            member = next((member for member in tar if os.path.basename(member.name) == dataset), None)
+            assert member is not None, f'{dataset} missing from {archive}'
+            yield tar.extractfile(member)
+    else:
+        with gzip.open(archive, 'rb') as file:
+            yield file
+
+
+def load_passage_index(path: str = "data/TREC_Passage"):
+    """ Returns the PassageIndex of collection.tsv, downloading and unpacking the collection on demand.
+
+    Random access needs the uncompressed file, unlike open_dataset, so the archive is unpacked here.
+
+    Args:
+        path (str): Location of dataset
+
+    Returns:
+        (PassageIndex): Passage index of collection.tsv
+
+    """
+    download_dataset(['collection.tsv'], path)
+    return PassageIndex(os.path.join(path, 'collection.tsv'))
+
+
 def import_val_test_queries(path: str = "data/TREC_Passage", qrels_val: list = None, qrels_test: list = None):
     """ Imports validation and test queries
 
@@ -138,23 +258,14 @@ def import_val_test_queries(path: str = "data/TREC_Passage", qrels_val: list = N
         test_df (pd.DataFrame): Query test IDs and content
 
     """
-    filepath = os.path.join(path, 'msmarco-test2019-queries.tsv')
-    if not os.path.exists(filepath):
-        LOGGER.debug("File not there, downloading a new one")
-        download_dataset(["msmarco-test2019-queries.tsv"], path)
-
     col_names = ["qID", "Query"]
-    val_df = pd.read_csv(filepath, sep="\t", names=col_names, header=None)
+    with open_dataset('msmarco-test2019-queries.tsv', path) as file:
+        val_df = pd.read_csv(file, sep="\t", names=col_names, header=None)
     if qrels_val is not None:
         val_df = val_df[val_df['qID'].isin(qrels_val)].reset_index(drop=True)
 
-    filepath = os.path.join(path, 'msmarco-test2020-queries.tsv')
-    if not os.path.exists(filepath):
-        LOGGER.debug("File not there, downloading a new one")
-        download_dataset(["msmarco-test2019-queries.tsv"], path)
-
-    col_names = ["qID", "Query"]
-    test_df = pd.read_csv(filepath, sep="\t", names=col_names, header=None)
+    with open_dataset('msmarco-test2020-queries.tsv', path) as file:
+        test_df = pd.read_csv(file, sep="\t", names=col_names, header=None)
     if qrels_test is not None:
         test_df = test_df[test_df['qID'].isin(qrels_test)].reset_index(drop=True)
     return val_df, test_df
@@ -171,46 +282,103 @@ def import_queries(path: str = "data/TREC_Passage", collection: list = None):
         df (pd.DataFrame): Query train IDs and content
 
     """
-    filepath = os.path.join(path, 'queries.train.tsv')
-    if not os.path.exists(filepath):
-        LOGGER.debug("File not there, downloading a new one")
-        download_dataset(["queries.train.tsv"], path)
-
     col_names = ["qID", "Query"]
-    df = pd.read_csv(filepath, sep="\t", names=col_names, header=None)
+    with open_dataset('queries.train.tsv', path) as file:
+        df = pd.read_csv(file, sep="\t", names=col_names, header=None)
     if collection is not None:
         df = df[df['qID'].isin(collection)].reset_index(drop=True)
 
     return df
 
 
-def import_collection(path: str = "data/TREC_Passage", qrels_val: list = None, qrels_test: list = None, triples: list = None, samples: int = 0):
+def import_collection(path: str = "data/TREC_Passage", qrels_val: list = None, qrels_test: list = None, triples: list = None, samples: int = 0,
+                      chunk_size: int = 1000000):
     """ Imports data from collection.tsv file
 
+    The file is read in chunks, keeping only the passages of qrels_val, qrels_test and triples and a uniform
+    sample of samples further passages, so memory is bounded by the result instead of the collection. Without
+    samples, the requested passages of an unpacked collection.tsv are read through its PassageIndex instead.
+    Both ways return the raw passage text, without quote handling, in the order of the file.
+
     Args:
         path (str): Location of dataset
         qrels_val (list):
         triples (list):
         samples (int): Specify number of rows to be imported from dataset
+        chunk_size (int): Number of rows read at once
 
     Returns:
         df (pd.DataFrame): Data frame containing IDs and Passages from collection dataset
 
     """
+    requested = None
+    if qrels_val is not None and qrels_test is not None and triples is not None:
+        requested = set(qrels_val) | set(qrels_test) | set(triples)
+
     filepath = os.path.join(path, 'collection.tsv')
-    if not os.path.exists(filepath):
-        LOGGER.debug("File not there, downloading a new one")
-        download_dataset(['collection.tsv'], path)
+    if requested is not None and samples <= 0 and os.path.exists(filepath):
+        index = PassageIndex(filepath)
+        ids = np.fromiter(requested, dtype=np.int64, count=len(requested))
+        ids = ids[np.isin(ids, index.ids)]
+        ids = ids[np.argsort(index.offsets[np.searchsorted(index.ids, ids)])]
+        df = index.passages(ids)
+        index.close()
+        return df
 
     col_names = ["pID", "Passage"]
-    df = pd.read_csv(filepath, sep="\t", names=col_names, header=None)
-    if samples > 0:
-        sampling = df.sample(samples, random_state=42).reset_index(drop=True)
-    if qrels_val is not None and qrels_test is not None and triples is not None:
-        df = df[(df['pID'].isin(qrels_val)) | (df['pID'].isin(qrels_test)) | (df['pID'].isin(triples))].reset_index(drop=True)
+    reservoir = _Reservoir(samples)
+    selected = []
+    with open_dataset('collection.tsv', path) as file:
+        for chunk in tqdm(pd.read_csv(file, sep="\t", names=col_names, header=None, chunksize=chunk_size,
+                                      quoting=csv.QUOTE_NONE, keep_default_na=False)):
+            if requested is None:
+                selected.append(chunk)
+                reservoir.add(chunk)
+                continue
+            relevant = chunk['pID'].isin(requested).values
+            selected.append(chunk[relevant])
+            reservoir.add(chunk[~relevant])
+
+    df = pd.concat(selected) if len(selected) > 0 else pd.DataFrame(columns=col_names)
     if samples > 0:
-        df = pd.concat([sampling, df]).reset_index(drop=True)
-    return df
+        df = pd.concat([reservoir.sample(), df])
+    return df.reset_index(drop=True)
+
+
+class _Reservoir(object):
+    """ Uniform sample without replacement of the rows of data frame chunks, drawn in a single pass.
+
+    Every row gets a random priority from a seeded generator and the samples rows of lowest priority are kept,
+    so only rows beating the current maximum priority of a full reservoir are ever copied.
+
+    Attributes:
+        samples (int): Number of rows to sample
+    """
+
+    def __init__(self, samples: int, seed: int = 42):
+        self.samples = samples
+        self.rng = np.random.default_rng(seed)
+        self.rows = None
+        self.priorities = np.zeros(0)
+
+    def add(self, chunk: pd.DataFrame):
+        """ Offers the rows of a chunk to the sample. """
+        if self.samples <= 0:
+            self.rows = chunk.iloc[:0]
+            return
+        priorities = self.rng.random(len(chunk))
+        if len(self.priorities) >= self.samples:
+            candidates = priorities < self.priorities.max()
+            chunk, priorities = chunk[candidates], priorities[candidates]
+
+        rows = chunk if self.rows is None else pd.concat([self.rows, chunk])
+        priorities = np.concatenate([self.priorities, priorities])
+        keep = np.argsort(priorities, kind='stable')[:self.samples]
+        self.rows, self.priorities = rows.iloc[keep], priorities[keep]
+
+    def sample(self):
+        """ Returns the sampled rows in random order. """
+        return self.rows if self.rows is not None else pd.DataFrame()
 
 
 def import_qrels(path: str = "data/TREC_Passage", samples: int = 5):
@@ -225,49 +393,48 @@ def import_qrels(path: str = "data/TREC_Passage", samples: int = 5):
         df_test (pd.DataFrame): Data frame containing test set
 
     """
-    filepath = os.path.join(path, '2019qrels-pass.txt')
-    if not os.path.exists(filepath):
-        LOGGER.debug("File not there, downloading a new one")
-        download_dataset(['2019qrels-pass.txt'], path)
-
     col_names = ["qID", "0", "pID", "feedback"]
-    df_val = pd.read_csv(filepath, sep=" ", names=col_names, header=None)
+    with open_dataset('2019qrels-pass.txt', path) as file:
+        df_val = pd.read_csv(file, sep=" ", names=col_names, header=None)
     df_val = df_val[df_val['feedback'] >= 1]
     sampled_qids = pd.Series(df_val['qID'].unique()).sample(samples, random_state=42).reset_index(drop=True)
     df_val = df_val[df_val['qID'].isin(sampled_qids)].reset_index(drop=True)
 
-    filepath = os.path.join(path, '2020qrels-pass.txt')
-    if not os.path.exists(filepath):
-        LOGGER.debug("File not there, downloading a new one")
-        download_dataset(['2020qrels-pass.txt'], path)
-
     col_names = ["qID", "0", "pID", "feedback"]
-    df_test = pd.read_csv(filepath, sep=" ", names=col_names, header=None)
+    with open_dataset('2020qrels-pass.txt', path) as file:
+        df_test = pd.read_csv(file, sep=" ", names=col_names, header=None)
     df_test = df_test[df_test['feedback'] >= 1]
     sampled_qids = pd.Series(df_test['qID'].unique()).sample(samples, random_state=42).reset_index(drop=True)
     df_test = df_test[df_test['qID'].isin(sampled_qids)].reset_index(drop=True)
     return df_val.drop(columns=['0']), df_test.drop(columns=['0'])
 
 
-def import_training_set(path: str = "data/TREC_Passage", samples: int = 200):
+def import_training_set(path: str = "data/TREC_Passage", samples: int = 200, chunk_size: int = 1000000,
+                        seed: int = 42):
     """ Imports data from qidpidtriples.train.full.2.tsv as training set
 
+    The triples are sampled uniformly in a single pass over the file with a seeded reservoir, so memory is
+    bounded by the sample instead of the hundreds of millions of triples.
+
     Args:
         path (str): Location of dataset
         samples (int): Specify number of rows to be imported from dataset
+        chunk_size (int): Number of rows read at once
+        seed (int): Seed of the sampling
 
     Returns:
         df (pd.DataFrame): Data frame containing training set
 
     """
-    filepath = os.path.join(path, 'qidpidtriples.train.full.2.tsv')
-    if not os.path.exists(filepath):
-        LOGGER.debug("File not there, downloading a new one")
-        download_dataset(['qidpidtriples.train.full.2.tsv'], path)
-
     col_names = ["qID", "positive", "negative"]
-    df = pd.read_csv(filepath, sep="\t", names=col_names, header=None)
-    df = df.sample(samples, random_state=42).reset_index(drop=True)
+    reservoir = _Reservoir(samples, seed)
+    with open_dataset('qidpidtriples.train.full.2.tsv', path) as file:
+        for chunk in tqdm(pd.read_csv(file, sep="\t", names=col_names, header=None, chunksize=chunk_size,
+                                      quoting=csv.QUOTE_NONE)):
+            reservoir.add(chunk)
+
+    df = reservoir.sample().reset_index(drop=True)
+    assert len(df) == samples, f'qidpidtriples.train.full.2.tsv contains less than {samples} triples'
     return pd.DataFrame({
         'qID': pd.concat([df['qID'], df['qID']]),
         'pID': pd.concat([df['positive'], df['negative']]),
@@ -0,0 +1,124 @@
+import mmap
+import os
+import logging
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+LOGGER = logging.getLogger('passages')
+
+
+class PassageIndex(object):
+    """ Random access to the passages of collection.tsv by pID without loading the collection.
+
+    A byte-offset index, the sorted pIDs and the offset of their line, is built in one scan of the file and
+    stored next to it as "<file>.ids.npy" and "<file>.offsets.npy", together with the size and modification time
+    of the file in "<file>.source.npy". The index is rebuilt once the file changes. Passages are read from the
+    memory-mapped file.
+
+    Attributes:
+        path (str): Path to collection.tsv
+        ids (np.array): Sorted pIDs of the collection
+        offsets (np.array): Byte offset of the line of every pID
+
+    Methods:
+    passages(ids: list):
+        Returns a data frame containing the passages of pIDs
+    close():
+        Unmaps the collection file
+    """
+
+    ids = None
+    offsets = None
+
+    def __init__(self, path: str = 'data/TREC_Passage/collection.tsv'):
+        """ Constructs passage index, building the byte-offset index if it does not exist yet or is outdated.
+
+        Args:
+            path (str): Path to collection.tsv
+
+        """
+        self.path = path
+        if not os.path.exists(path):
+            raise FileNotFoundError(f'{path} is not unpacked, the passage index needs the uncompressed file. Use '
+                                    f'load_passage_index of src.data.dataset to download and unpack it.')
+        if not self._current():
+            self._build()
+
+        self.ids = np.load(path + '.ids.npy', mmap_mode='r')
+        self.offsets = np.load(path + '.offsets.npy', mmap_mode='r')
+        self.file = open(path, 'rb')
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if len(self.ids) > 0 else b''
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, pid: int):
+        position = np.searchsorted(self.ids, pid)
+        return position < len(self.ids) and self.ids[position] == pid
+
+    def __getitem__(self, pid: int):
+        """ Returns the passage of a pID. """
+        position = np.searchsorted(self.ids, pid)
+        if position == len(self.ids) or self.ids[position] != pid:
+            raise KeyError(pid)
+        return self._read(self.offsets[position])
+
+    def passages(self, ids: list):
+        """ Returns a data frame containing the passages of pIDs.
+
+        Args:
+            ids (list): pIDs to read, the rows are returned in the same order
+
+        Returns:
+            df (pd.DataFrame): Data frame containing columns "pID" and "Passage"
+
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        positions = np.searchsorted(self.ids, ids)
+        assert (positions < len(self.ids)).all() and (self.ids[positions] == ids).all(), \
+            'pID missing from collection'
+
+        return pd.DataFrame({'pID': ids, 'Passage': [self._read(self.offsets[i]) for i in positions]})
+
+    def close(self):
+        """ Unmaps the collection file. """
+        if isinstance(self.mmap, mmap.mmap):
+            self.mmap.close()
+        self.file.close()
+
+    def _read(self, offset: int):
+        """ Returns the passage of the line starting at a byte offset. """
+        end = self.mmap.find(b'\n', offset)
+        line = self.mmap[offset:end if end >= 0 else len(self.mmap)]
+        return line[line.index(b'\t') + 1:].rstrip(b'\r').decode('utf-8')
+
+    def _source(self):
+        """ Returns size and modification time of the collection file. """
+        status = os.stat(self.path)
+        return np.array([status.st_size, status.st_mtime_ns], dtype=np.int64)
+
+    def _current(self):
+        """ Returns whether a stored index exists and was built from the current collection file. """
+        if not all(os.path.exists(self.path + suffix) for suffix in ['.ids.npy', '.offsets.npy', '.source.npy']):
+            return False
+        return np.array_equal(np.load(self.path + '.source.npy'), self._source())
+
+    def _build(self):
+        """ Scans the collection once and stores the sorted pIDs with the byte offsets of their lines. """
+        LOGGER.info(f'Building passage index of {self.path}')
+        source = self._source()
+        ids, offsets = [], []
+        offset = 0
+        with open(self.path, 'rb') as file:
+            for line in tqdm(file):
+                if line.strip():
+                    ids.append(int(line[:line.index(b'\t')]))
+                    offsets.append(offset)
+                offset += len(line)
+
+        ids = np.array(ids, dtype=np.int64)
+        order = np.argsort(ids, kind='stable')
+        np.save(self.path + '.ids.npy', ids[order])
+        np.save(self.path + '.offsets.npy', np.array(offsets, dtype=np.int64)[order])
+        np.save(self.path + '.source.npy', source)
@@ -10,6 +10,12 @@ import logging
 import numpy as np
 from sklearn.preprocessing import StandardScaler
 import random
+import os
+from functools import partial
+from collections import OrderedDict
+from multiprocessing import Pool
+from tqdm import tqdm
+from src.utils.utils import save, load, check_path_exists
 
 nltk.download('punkt')
 nltk.download('stopwords')
@@ -17,13 +23,19 @@ nltk.download('wordnet')
 
 LOGGER = logging.getLogger('Preprocessor')
 
+PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+STOPWORDS = frozenset(stopwords.words("english"))
 
-def preprocess(data: pd.Series, expansion: bool = False):
+
+def preprocess(data: pd.Series, expansion: bool = False, workers: int = 1, chunk_size: int = 10000):
     """ Preprocess Text using tokenization, removing punctuation and stopwords, text expansion, stemming
 
     Args:
         data (pd.Series): Series of strings
         expansion (bool): Decide whether to use word expansion on data or not
+        workers (int): Number of processes, all cores if None. Chunks of data are distributed over a process pool
+            if larger than 1, the output order always matches data
+        chunk_size (int): Number of strings sent to a process at once
 
     Returns:
         data (pd.Series): Series of np.arrays containing preprocessed text
@@ -31,19 +43,51 @@ def preprocess(data: pd.Series, expansion: bool = False):
     """
     LOGGER.info('Preprocessing ...')
 
+    workers = os.cpu_count() if workers is None else workers
+    if workers <= 1:
+        return data.progress_apply(lambda text: preprocess_text(text, expansion))
+
+    chunks = [data.iloc[start:start + chunk_size].tolist() for start in range(0, len(data), chunk_size)]
+    with Pool(workers) as pool:
+        results = list(tqdm(pool.imap(partial(_preprocess_chunk, expansion=expansion), chunks), total=len(chunks)))
+
+    for _, changes in results:
+        STEM_CACHE.merge(changes)
+
+    return pd.Series([tokens for chunk, _ in results for tokens in chunk], index=data.index, dtype=object)
+
+
+def preprocess_text(text: str, expansion: bool = False):
+    """ Preprocess a single text using tokenization, removing punctuation and stopwords, text expansion, stemming
+
+    Args:
+        text (str): String of text
+        expansion (bool): Decide whether to use word expansion on text or not
+
+    Returns:
+        (np.array): Array containing preprocessed tokens
+
+    """
     if expansion:
-        return data.progress_apply(lambda text: np.array(
+        return np.array(
             stemming(
                 query_expansion(
                     removal(
                         tokenization(text)
-                    )))))
+                    ))), dtype=object)
     else:
-        return data.progress_apply(lambda text: np.array(
+        return np.array(
             stemming(
                 removal(
                     tokenization(text)
-                ))))
+                )), dtype=object)
+
+
+def _preprocess_chunk(texts: list, expansion: bool = False):
+    """ Preprocesses a chunk of texts inside a worker process and returns the stem cache changes with it. """
+    STEM_CACHE.record = True
+    STEM_CACHE.pop_changes()
+    return [preprocess_text(text, expansion) for text in texts], STEM_CACHE.pop_changes()
 
 
 def tokenization(text: str):
@@ -53,58 +97,181 @@ def tokenization(text: str):
         text (str): String of text
 
     Returns:
-        (pd.Series): Series containing lowered tokens
+        (list): List containing lowered tokens
 
     """
-    return pd.Series(nltk.word_tokenize(text.lower()))
+    return nltk.word_tokenize(text.lower())
 
 
-def removal(tokens: pd.Series):
-    """ Remove punctuation, stopwords and NA values
+def removal(tokens: list):
+    """ Remove punctuation, stopwords and empty tokens
 
     Args:
-        tokens (pd.Series): Series of tokens
+        tokens (list): List of tokens
 
     Returns:
-        tokens (pd.Series): Series containing tokens with punctuation, stopwords and NA values removed
+        tokens (list): List containing tokens with punctuation, stopwords and empty tokens removed
 
     """
-    stopwords_list = stopwords.words("english")
+    tokens = [token.translate(PUNCTUATION_TABLE) for token in tokens]
 
-    tokens = tokens.apply(lambda token: token.translate(str.maketrans('', '', string.punctuation)))
-    tokens = tokens.apply(lambda token: token if token not in stopwords_list and token != '' else None).dropna()
+    return [token for token in tokens if token and token not in STOPWORDS]
 
-    return tokens
 
-
-def stemming(tokens: pd.Series):
+def stemming(tokens: list):
     """ Stem tokens using nltk PorterStemmer method
 
     Args:
-        tokens (pd.Series): Series of tokens
+        tokens (list): List of tokens
 
     Returns:
-        tokens (pd.Series): Series containing stemmed tokens
+        tokens (list): List containing stemmed tokens
 
     """
-    stemmer = PorterStemmer()
-
-    return tokens.apply(lambda token: stemmer.stem(token))
+    return [STEM_CACHE(token) for token in tokens]
 
 
-def lemmatization(tokens: pd.Series):
+def lemmatization(tokens: list):
     """ Lemmatize tokens using nltk WordNetLemmatizer method
 
     Args:
-        tokens (pd.Series): Series of tokens
+        tokens (list): List of tokens
 
     Returns:
-        tokens (pd.Series): Series containing lemmatized tokens
+        tokens (list): List containing lemmatized tokens
 
     """
-    lemmatizer = WordNetLemmatizer()
+    return [LEMMA_CACHE(token) for token in tokens]
+
+
+class TokenCache(object):
+    """ A size-bounded least recently used cache mapping tokens to their stem or lemma.
+
+    Attributes:
+        function (callable): Computes the value of a token missing in the cache
+        maxsize (int): Maximum number of cached tokens
+        hits (int): Number of lookups answered from the cache
+        misses (int): Number of lookups that called function
+        record (bool): Whether entries added are kept for pop_changes, only set inside worker processes
+
+    Methods:
+    __call__(token: str):
+        Returns the cached value of a token, computing it on a miss
+    statistics():
+        Returns size, hits, misses and hit rate
+    save(path: str):
+        Stores the cached tokens to disk
+    load(path: str):
+        Adds the tokens stored at path to the cache
+    pop_changes():
+        Returns and resets entries and counts since the last call
+    merge(changes: tuple):
+        Adds changes from pop_changes of another process
+    """
+
+    def __init__(self, function, maxsize: int = 2 ** 20):
+        """ Constructs an empty cache.
+
+        Args:
+            function (callable): Computes the value of a token missing in the cache
+            maxsize (int): Maximum number of cached tokens
+
+        """
+        self.function = function
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.added = []
+        self.record = False
+        self.hits = 0
+        self.misses = 0
 
-    return tokens.apply(lambda token: lemmatizer.lemmatize(token))
+    def __call__(self, token: str):
+        value = self.entries.get(token)
+        if value is None:
+            self.misses += 1
+            value = self.function(token)
+            self._add(token, value)
+            if self.record:
+                self.added.append((token, value))
+        else:
+            self.hits += 1
+            self.entries.move_to_end(token)
+        return value
+
+    def statistics(self):
+        """ Returns size, hits, misses and hit rate of the cache.
+
+        Returns:
+            (dict): Dictionary containing "size", "hits", "misses" and "hit_rate"
+
+        """
+        lookups = self.hits + self.misses
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups > 0 else 0.0}
+
+    def save(self, path: str):
+        """ Stores the cached tokens, least recently used first.
+
+        Args:
+            path (str): Path to store the cache to
+
+        Returns:
+            path (str): Path the cache has been stored to
+
+        """
+        check_path_exists(os.path.dirname(path))
+        return save(list(self.entries.items()), path)
+
+    def load(self, path: str):
+        """ Adds the tokens stored at path to the cache if the file exists.
+
+        Args:
+            path (str): Path of a stored cache
+
+        Returns:
+            self (TokenCache): The cache
+
+        """
+        if os.path.exists(path):
+            for token, value in load(path):
+                self._add(token, value)
+            LOGGER.info(f'Loaded {len(self.entries)} cached tokens from {path}')
+        return self
+
+    def pop_changes(self):
+        """ Returns the entries added and the hits and misses counted since the last call and resets them.
+
+        Returns:
+            (tuple): Added entries, hits and misses
+
+        """
+        changes = self.added, self.hits, self.misses
+        self.added, self.hits, self.misses = [], 0, 0
+        return changes
+
+    def merge(self, changes: tuple):
+        """ Adds entries, hits and misses returned by pop_changes of a worker process.
+
+        Args:
+            changes (tuple): Added entries, hits and misses
+
+        """
+        added, hits, misses = changes
+        for token, value in added:
+            self._add(token, value)
+        self.hits += hits
+        self.misses += misses
+
+    def _add(self, token: str, value: str):
+        """ Inserts a token as most recently used and evicts the least recently used tokens beyond maxsize. """
+        self.entries[token] = value
+        self.entries.move_to_end(token)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+
+STEM_CACHE = TokenCache(PorterStemmer().stem)
+LEMMA_CACHE = TokenCache(WordNetLemmatizer().lemmatize)
 
 
 def pca(features: pd.DataFrame, components: int = 5):
@@ -169,28 +336,26 @@ def split_and_scale(X_y_train, X_test, X_val=None, components_pca: int = 0):
     return X, y, X_test, test_pair
 
 
-def query_expansion(tokens: pd.Series, sample_size=2):
-    """ Expand series of tokens with synonyms
+def query_expansion(tokens: list, sample_size=2):
+    """ Expand list of tokens with synonyms
 
     Args:
-        tokens (pd.Series): Series of tokens
+        tokens (list): List of tokens
         sample_size (int):
 
     Returns:
-        new_tokenlist (pd.Series):
+        new_tokenlist (list):
 
     """
-    token_list = tokens.tolist()
-
     new_tokenlist = []
-    for token in token_list:
+    for token in tokens:
         synonyms = get_synonyms(token, sample_size)
 
         new_tokenlist.append(token)
         if len(synonyms) > 0:
             new_tokenlist.extend(synonyms)
 
-    return pd.Series(new_tokenlist)
+    return new_tokenlist
 
 
 def get_synonyms(phrase, sample_size):
@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+import logging
+
+LOGGER = logging.getLogger('vocabulary')
+
+
+class EncodedTokens(object):
+    """ Token ids of many texts stored in compressed sparse row layout.
+
+    The ids of text i are ids[offsets[i]:offsets[i + 1]].
+
+    Attributes:
+        offsets (np.array): int64 array of length number of texts + 1
+        ids (np.array): int32 array containing the token ids of all texts
+
+    Methods:
+    lengths():
+        Returns the number of tokens per text
+    to_series(index: pd.Index = None):
+        Returns a series of int32 views, one per text
+    """
+
+    def __init__(self, offsets: np.ndarray, ids: np.ndarray):
+        """ Constructs encoded tokens.
+
+        Args:
+            offsets (np.array): Start of every text in ids followed by the total number of ids
+            ids (np.array): Token ids of all texts
+
+        """
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.ids = np.asarray(ids, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int):
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def lengths(self):
+        """ Returns the number of tokens per text.
+
+        Returns:
+            (np.array): Number of tokens per text
+
+        """
+        return np.diff(self.offsets)
+
+    def to_series(self, index: pd.Index = None):
+        """ Returns a series of int32 views into ids, so all texts share one contiguous buffer.
+
+        Args:
+            index (pd.Index): Index of the returned series
+
+        Returns:
+            (pd.Series): Series of np.arrays containing token ids
+
+        """
+        return pd.Series(list(self), index=index, dtype=object)
+
+
+class Vocabulary(object):
+    """ A class to map preprocessed tokens to int32 ids.
+
+    Attributes:
+        terms (pd.Index): Token of every id
+
+    Methods:
+    encode(text_in_tokens: pd.Series, update: bool = True):
+        Encodes series of preprocessed tokens to token ids
+    decode(ids: np.array):
+        Returns the tokens of token ids
+    """
+
+    def __init__(self):
+        """ Constructs an empty vocabulary. """
+        self.terms = pd.Index([], dtype=object)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def encode(self, text_in_tokens: pd.Series, update: bool = True):
+        """ Encodes series of preprocessed tokens to token ids.
+
+        Args:
+            text_in_tokens (pd.Series): Series of preprocessed tokens
+            update (bool): Adds unknown tokens to the vocabulary if True, drops them otherwise
+
+        Returns:
+            (EncodedTokens): Token ids of all texts
+
+        """
+        lengths = np.fromiter((len(tokens) for tokens in text_in_tokens), dtype=np.int64, count=len(text_in_tokens))
+        tokens = np.concatenate([np.asarray(tokens, dtype=object) for tokens in text_in_tokens]) \
+            if lengths.sum() > 0 else np.array([], dtype=object)
+
+        ids = self.terms.get_indexer(tokens)
+        if update and (ids < 0).any():
+            self.terms = self.terms.append(pd.Index(pd.unique(tokens[ids < 0])))
+            ids = self.terms.get_indexer(tokens)
+            LOGGER.info(f'Vocabulary contains {len(self.terms)} tokens')
+        elif not update:
+            known = ids >= 0
+            lengths = np.bincount(np.repeat(np.arange(len(lengths)), lengths)[known], minlength=len(lengths))
+            ids = ids[known]
+
+        return EncodedTokens(np.concatenate([[0], np.cumsum(lengths)]), ids)
+
+    def decode(self, ids: np.ndarray):
+        """ Returns the tokens of token ids.
+
+        Args:
+            ids (np.array): Token ids
+
+        Returns:
+            (np.array): Array containing tokens
+
+        """
+        return self.terms.values[ids]
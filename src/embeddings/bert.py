@@ -1,41 +1,74 @@
-from sentence_transformers import SentenceTransformer
+from sentence_transformers import SentenceTransformer, __version__ as sentence_transformers_version
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
-from src.utils.utils import check_path_exists, save
-import os
+from src.utils.utils import save_embeddings
+from src.embeddings.cache import EmbeddingCache
 
 
 class Bert(object):
     """ A class to create bert embeddings.
 
+    Attributes:
+        batch_size (int): Number of texts encoded at once
+        cache (EmbeddingCache): Cache of already encoded texts, None if disabled
+
     Methods:
     transform(raw_texts: pd.Series, store: str = None):
         Transforms series of unpreprocessed strings to bert embeddings
     """
-    def __init__(self):
-        """ Constructs bert object using a pretrained model. """
+    model_name = "multi-qa-MiniLM-L6-cos-v1"
+
+    def __init__(self, batch_size: int = 64, cache: str = 'data/embeddings/cache'):
+        """ Constructs bert object using a pretrained model.
+
+        Args:
+            batch_size (int): Number of texts encoded at once
+            cache (str): Directory of the embedding cache, texts are always encoded if None
+
+        """
         self.model = SentenceTransformer(
-            "multi-qa-MiniLM-L6-cos-v1")
+            self.model_name)
+        self.batch_size = batch_size
+        self.cache = EmbeddingCache(cache) if cache is not None else None
 
     # Dont Preprocess Texts beforehand!
-    def transform(self, raw_texts: pd.Series, store: str = None):
+    def transform(self, raw_texts: pd.Series, store: str = None, ids: list = None):
         """ Transform Series of unpreprocessed strings to bert embeddings.
 
+        Texts are sorted by length and encoded in batches of similar length to keep padding small. Texts found
+        in the embedding cache are not encoded again.
+
         Args:
             raw_texts (pd.Series): Series of unpreprocessed strings
+            store (str): Directory to store embeddings to
+            ids (list): IDs of the texts stored with the embeddings
 
         Returns:
-            bert_vec (list): List containing bert embeddings
+            bert_vec (np.array): float32 matrix containing one bert embedding per row, in the order of raw_texts
 
         """
-        bert_vec = []
-
-        for text in tqdm(raw_texts):
-            embedding = self.model.encode(text)
-            bert_vec.append(embedding)
+        texts = list(raw_texts)
+        if self.cache is not None:
+            bert_vec = self.cache.transform(
+                f'bert|{self.model_name}|{sentence_transformers_version}|{self.model.max_seq_length}', texts,
+                self._encode)
+        else:
+            bert_vec = self._encode(texts)
 
         if store is not None:
-            check_path_exists(os.path.dirname(store))
-            save(bert_vec, store)
+            save_embeddings(bert_vec, store, ids)
+
+        return bert_vec
+
+    def _encode(self, texts: list):
+        """ Encodes texts in batches of similar length into a preallocated float32 matrix. """
+        bert_vec = np.zeros((len(texts), self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        order = np.argsort([len(text) for text in texts], kind='stable')[::-1]
+
+        for start in tqdm(range(0, len(texts), self.batch_size)):
+            batch = order[start:start + self.batch_size]
+            bert_vec[batch] = self.model.encode([texts[i] for i in batch], batch_size=self.batch_size,
+                                                convert_to_numpy=True, show_progress_bar=False)
 
         return bert_vec
@@ -0,0 +1,160 @@
+import hashlib
+import numpy as np
+import pandas as pd
+import logging
+import os
+import shutil
+from src.utils.utils import check_path_exists, save_embeddings, load_embeddings, load_embedding_ids
+
+LOGGER = logging.getLogger('cache')
+
+
+class EmbeddingCache(object):
+    """ A content-addressed cache of embeddings keyed by model identity and a hash of the embedded input.
+
+    Every model gets its own directory named after the hash of its identity. Each call adding new embeddings
+    stores them as another chunk in the format of save_embeddings, with the input hashes as IDs. Once a model has
+    more than max_chunks chunks, they are merged into one.
+
+    Attributes:
+        path (str): Directory of the cache
+        max_chunks (int): Number of chunks per model above which the chunks are merged
+
+    Methods:
+    transform(model: str, inputs: list, transform: callable):
+        Returns embeddings of inputs, computing only those missing in the cache
+    hash(inputs: list):
+        Returns a 64 bit hash of every input
+    """
+
+    max_chunks = 16
+
+    def __init__(self, path: str = 'data/embeddings/cache', max_chunks: int = 16):
+        """ Constructs cache object.
+
+        Args:
+            path (str): Directory of the cache
+            max_chunks (int): Number of chunks per model above which the chunks are merged
+
+        """
+        self.path = path
+        self.max_chunks = max_chunks
+
+    def transform(self, model: str, inputs: list, transform):
+        """ Returns embeddings of inputs, computing only those missing in the cache.
+
+        Args:
+            model (str): Identity of the model, e.g. name, version and parameters
+            inputs (list): Strings or arrays of tokens to embed
+            transform (callable): Returns a matrix with one embedding per row for a list of inputs
+
+        Returns:
+            embeddings (np.array): float32 matrix containing one embedding per input
+
+        """
+        directory = os.path.join(self.path, hashlib.blake2b(model.encode(), digest_size=8).hexdigest())
+        keys = self.hash(inputs)
+        positions, rows = [], []
+        missing = np.ones(len(inputs), dtype=bool)
+
+        for chunk in self._chunks(directory):
+            found = pd.Index(load_embedding_ids(chunk)).get_indexer(keys)
+            hits = missing & (found >= 0)
+            if hits.any():
+                positions.append(np.flatnonzero(hits))
+                rows.append(np.asarray(load_embeddings(chunk)[found[hits]], dtype=np.float32))
+                missing &= ~hits
+
+        LOGGER.info(f'{len(inputs) - missing.sum()} of {len(inputs)} embeddings cached for {model}')
+
+        if missing.any() or len(inputs) == 0:
+            new_keys, first, inverse = np.unique(keys[missing], return_index=True, return_inverse=True)
+            new_positions = np.flatnonzero(missing)
+            embeddings = np.asarray(transform([inputs[i] for i in new_positions[first]]), dtype=np.float32)
+            if len(new_keys) > 0:
+                self._add(directory, model, new_keys, embeddings)
+            positions.append(new_positions)
+            rows.append(embeddings[inverse.ravel()] if len(new_keys) > 0 else embeddings)
+
+        dimension = rows[0].shape[1] if rows[0].ndim == 2 else 0
+        output = np.zeros((len(inputs), dimension), dtype=np.float32)
+        for position, row in zip(positions, rows):
+            output[position] = row
+
+        return output
+
+    @staticmethod
+    def hash(inputs: list):
+        """ Returns a 64 bit blake2b hash of every input.
+
+        The hashed bytes carry the type and length of the input, so a string never shares its key with a list of
+        tokens and token ids never share theirs with tokens.
+
+        Args:
+            inputs (list): Strings, arrays of tokens or arrays of token ids
+
+        Returns:
+            (np.array): uint64 hash per input
+
+        """
+        return np.fromiter((int.from_bytes(hashlib.blake2b(EmbeddingCache._encode(entry), digest_size=8).digest(),
+                                           'little') for entry in inputs), dtype=np.uint64, count=len(inputs))
+
+    @staticmethod
+    def _encode(entry):
+        """ Returns the bytes hashed for an input, a type tag and the element count followed by the elements. """
+        if isinstance(entry, str):
+            return b's' + entry.encode()
+
+        values = np.asarray(entry)
+        header = len(values).to_bytes(8, 'little') if values.ndim > 0 else b''
+        if values.dtype.kind in 'biu':
+            return b'i' + header + values.astype('<i8').tobytes()
+        if values.dtype.kind in 'UO':
+            tokens = [str(token).encode() for token in values.ravel()]
+            return b't' + header + b''.join(len(token).to_bytes(8, 'little') + token for token in tokens)
+        return b'a' + values.dtype.str.encode() + str(values.shape).encode() + values.tobytes()
+
+    @staticmethod
+    def _chunks(directory: str):
+        """ Returns the chunk directories of a model, oldest first. """
+        if not os.path.isdir(directory):
+            return []
+        return [os.path.join(directory, chunk) for chunk in sorted(os.listdir(directory), key=lambda name: (
+            len(name), name)) if chunk.isdigit() and os.path.isdir(os.path.join(directory, chunk))]
+
+    def _add(self, directory: str, model: str, keys: np.ndarray, embeddings: np.ndarray):
+        """ Stores new embeddings as next chunk of a model, merging the chunks once there are too many. """
+        check_path_exists(directory)
+        with open(os.path.join(directory, 'model.txt'), 'w') as file:
+            file.write(model)
+        chunks = self._chunks(directory)
+        save_embeddings(embeddings, os.path.join(directory, str(int(os.path.basename(chunks[-1])) + 1)
+                                                 if len(chunks) > 0 else '0'), ids=keys)
+
+        if len(chunks) + 1 > self.max_chunks:
+            self._merge(directory)
+
+    def _merge(self, directory: str):
+        """ Merges all chunks of a model into chunk 0, copying the embeddings chunk by chunk. """
+        chunks = self._chunks(directory)
+        merged = os.path.join(directory, 'merged')
+        if os.path.exists(merged):
+            shutil.rmtree(merged)
+        check_path_exists(merged)
+        LOGGER.info(f'Merging {len(chunks)} cache chunks of {directory}')
+
+        matrices = [load_embeddings(chunk) for chunk in chunks]
+        matrix = np.lib.format.open_memmap(os.path.join(merged, 'embeddings.npy'), mode='w+', dtype=np.float32,
+                                           shape=(sum(len(rows) for rows in matrices), matrices[0].shape[1]))
+        start = 0
+        for rows in matrices:
+            matrix[start:start + len(rows)] = rows
+            start += len(rows)
+        matrix.flush()
+        del matrix, matrices
+        np.save(os.path.join(merged, 'ids.npy'), np.concatenate([load_embedding_ids(chunk) for chunk in chunks]))
+
+        for chunk in chunks:
+            shutil.rmtree(chunk)
+        os.replace(merged, os.path.join(directory, '0'))
@@ -1,51 +1,89 @@
 from flair.embeddings import WordEmbeddings
-from flair.data import Sentence
+from flair import __version__ as flair_version
+import numpy as np
 import pandas as pd
-from src.utils.utils import check_path_exists, save
-import os
-from tqdm import tqdm
-import torch
-from nltk.tokenize.treebank import TreebankWordDetokenizer
+import scipy.sparse as sp
+from src.utils.utils import save_embeddings
+from src.embeddings.cache import EmbeddingCache
 
 
 class Glove(object):
     """ A class to create glove embeddings.
 
+    The pretrained vectors are loaded once into a lookup table. Texts are embedded as the product of their sparse
+    bag-of-words matrix and the vector matrix, i.e. the sum of their glove token embeddings.
+
+    Attributes:
+        terms (pd.Index): Token of every row of vectors
+        vectors (np.array): float32 matrix containing one glove embedding per token
+        cache (EmbeddingCache): Cache of already embedded token arrays, None if disabled
+
     Methods:
     transform(text_in_tokens: pd.Series, store: str = None)
         Transform series of preprocessed tokens to glove embeddings
     """
-    glove = None
+    terms = None
+    vectors = None
 
-    def __init__(self):
-        """ Constructs glove object using a pretrained model. """
-        self.glove = WordEmbeddings('glove')
+    def __init__(self, cache: str = 'data/embeddings/cache'):
+        """ Constructs glove object using a pretrained model.
+
+        Args:
+            cache (str): Directory of the embedding cache, tokens are always embedded if None
 
-    def transform(self, text_in_tokens: pd.Series, store: str = None):
+        """
+        glove = WordEmbeddings('glove')
+        if hasattr(glove, 'vocab'):
+            self.terms = pd.Index(list(glove.vocab.keys()))
+            self.vectors = glove.embedding.weight.detach().cpu().numpy()[list(glove.vocab.values())]
+        else:
+            self.terms = pd.Index(glove.precomputed_word_embeddings.index_to_key)
+            self.vectors = glove.precomputed_word_embeddings.vectors
+        self.vectors = np.asarray(self.vectors, dtype=np.float32)
+        self.cache = EmbeddingCache(cache) if cache is not None else None
+
+    def transform(self, text_in_tokens: pd.Series, store: str = None, ids: list = None):
         """ Transform series of preprocessed tokens to glove embeddings.
     
         Args:
             text_in_tokens (pd.Series): Series of preprocessed tokens
+            store (str): Directory to store embeddings to
+            ids (list): IDs of the texts stored with the embeddings
 
         Returns:
-            glove_vec (list): List containing glove embeddings
+            glove_vec (np.array): float32 matrix containing one glove embedding per row
 
         """
-        glove_vec = []
-
-        for line in tqdm(text_in_tokens):
-            detokenized = TreebankWordDetokenizer().detokenize(line)
-            sentence = Sentence(detokenized)
-            self.glove.embed(sentence)
-            input = torch.empty(sentence[0].embedding.size())
-            token_per_sentence = torch.zeros_like(input)
-
-            for token in sentence:
-                token_per_sentence = torch.add(token_per_sentence, token.embedding)
-            glove_vec.append(token_per_sentence.numpy())
+        if self.cache is not None:
+            glove_vec = self.cache.transform(f'glove|lookup-digits|{flair_version}', list(text_in_tokens), self._embed)
+        else:
+            glove_vec = self._embed(list(text_in_tokens))
 
         if store is not None:
-            check_path_exists(os.path.dirname(store))
-            save(glove_vec, store)
+            save_embeddings(glove_vec, store, ids)
 
         return glove_vec
+
+    def _embed(self, text_in_tokens: list):
+        """ Embeds token arrays as sum of their glove token embeddings, unknown tokens are ignored.
+
+        Like flair's WordEmbeddings, a token missing from the vocabulary is looked up lowercased and then
+        lowercased with its digits replaced by "#" and by "0".
+        """
+        lengths = np.fromiter((len(tokens) for tokens in text_in_tokens), dtype=np.int64, count=len(text_in_tokens))
+        tokens = pd.Index(np.concatenate([np.asarray(tokens, dtype=object) for tokens in text_in_tokens])
+                          if lengths.sum() > 0 else np.array([], dtype=object))
+
+        rows = self.terms.get_indexer(tokens)
+        for normalize in [lambda words: words.str.lower(),
+                          lambda words: words.str.lower().str.replace(r'\d', '#', regex=True),
+                          lambda words: words.str.lower().str.replace(r'\d', '0', regex=True)]:
+            unknown = rows < 0
+            rows[unknown] = self.terms.get_indexer(normalize(tokens[unknown]))
+        texts = np.repeat(np.arange(len(text_in_tokens)), lengths)
+
+        known = rows >= 0
+        bag_of_words = sp.csr_matrix((np.ones(known.sum(), dtype=np.float32), (texts[known], rows[known])),
+                                     shape=(len(text_in_tokens), len(self.terms)))
+
+        return np.asarray(bag_of_words @ self.vectors, dtype=np.float32)
@@ -1,8 +1,7 @@
 from sklearn.feature_extraction.text import TfidfVectorizer
 import pandas as pd
-from tqdm import tqdm
-import numpy as np
-from src.utils.utils import check_path_exists, save, load
+from src.utils.utils import check_path_exists, save, load, save_embeddings
+from src.data.vocabulary import EncodedTokens
 import os
 
 
@@ -11,6 +10,7 @@ class TFIDF(object):
 
     Attributes:
         path (str):
+        terms (pd.Index): Token of every column of the tfidf matrix, built once when fitting
 
     Methods:
     fit(text_in_tokens: pd.Series, store: str = "models/tfidf.pkl"):
@@ -21,6 +21,7 @@ class TFIDF(object):
     """
 
     vectorizer = None
+    terms = None
     fitted = False
 
     def __init__(self, path: str = None):
@@ -32,12 +33,13 @@ class TFIDF(object):
         """
         if path is not None:
             self.vectorizer = load(path)
+            self.terms = pd.Index(self.vectorizer.get_feature_names_out())
 
     def fit(self, text_in_tokens: pd.Series, store: str = "models/tfidf.pkl"):
         """ Fits the tfidf model to the data.
 
         Args:
-            text_in_tokens (pd.Series): Series of preprocessed tokens
+            text_in_tokens (pd.Series or EncodedTokens): Series of preprocessed tokens or token ids
             store (str): Path to store model to
 
         Returns:
@@ -47,8 +49,12 @@ class TFIDF(object):
         def dummy(text):
             return text
 
+        if isinstance(text_in_tokens, EncodedTokens):
+            text_in_tokens = text_in_tokens.to_series()
+
         self.vectorizer = TfidfVectorizer(tokenizer=lambda text: text, lowercase=False)
         self.vectorizer.fit(text_in_tokens)
+        self.terms = pd.Index(self.vectorizer.get_feature_names_out())
 
         if store is not None:
             check_path_exists(os.path.dirname(store))
@@ -58,43 +64,26 @@ class TFIDF(object):
 
         return self
 
-    def transform(self, text_in_tokens: pd.Series, store: str = None):
+    def transform(self, text_in_tokens: pd.Series, store: str = None, ids: list = None):
         """ Transform series of preprocessed tokens to tfidf embeddings.
 
         Args:
-            text_in_tokens (pd.Series): Series of preprocessed tokens
-            store (str): Path to tfidf embeddings to
+            text_in_tokens (pd.Series or EncodedTokens): Series of preprocessed tokens or token ids
+            store (str): Directory to store tfidf embeddings to
+            ids (list): IDs of the texts stored with the embeddings
 
         Returns:
-            tf_idf_vec (np.array): Array containing tfidf embeddings
+            tfidf_matrix (sp.csr_matrix): Sparse matrix containing one tfidf embedding per row, its columns are the
+                tokens of terms
 
         """
         assert self.vectorizer is not None, 'You need to fit me first'
+        if isinstance(text_in_tokens, EncodedTokens):
+            text_in_tokens = text_in_tokens.to_series()
 
-        tfidf_matrix = self.vectorizer.transform(text_in_tokens)
-        token_names = self.vectorizer.get_feature_names_out()
-        tf_idf_dict = {}
-        j = 0
-
-        for name in token_names:
-            tf_idf_dict[name] = j
-            j += 1
-
-        tf_idf_list = []
-        for i in tqdm(range(len(text_in_tokens))):
-            tf_idf_token = {}
-            for token in text_in_tokens.iloc[i]:
-                if token in tf_idf_dict.keys():
-                    tf_idf_token[token] = tfidf_matrix[i, tf_idf_dict[token]]
-                else:
-                    tf_idf_token[token] = .0
-            tf_idf_list.append(tf_idf_token)
-        tf_idf_vec = np.array(tf_idf_list)
+        tfidf_matrix = self.vectorizer.transform(text_in_tokens).tocsr()
 
         if store is not None:
-            check_path_exists(os.path.dirname(store))
-            save(tfidf_matrix, store)
-
-        return tf_idf_vec
-
+            save_embeddings(tfidf_matrix, store, ids)
 
+        return tfidf_matrix
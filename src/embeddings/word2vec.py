@@ -1,8 +1,8 @@
 from gensim.models import Word2Vec
-from src.utils.utils import check_path_exists, save
+from src.utils.utils import save_embeddings
 import numpy as np
 import pandas as pd
-import os
+import scipy.sparse as sp
 from tqdm import tqdm
 import logging
 
@@ -79,15 +79,17 @@ class word2vec(object):
         self.embedding.build_vocab(new_text_in_tokens, update=True)
         self.embedding.train(new_text_in_tokens, total_examples=self.embedding.corpus_count, epochs=self.embedding.epochs)
 
-    def transform(self, text_in_tokens: pd.Series, store: str = None):
+    def transform(self, text_in_tokens: pd.Series, store: str = None, ids: list = None):
         """ Transforms series of preprocessed tokens to word2vec embeddings.
 
         Args:
             new_text_in_tokens (pd.Series): Series of preprocessed tokens
-            store (str): Path to store model to
+            store (str): Directory to store embeddings to
+            ids (list): IDs of the texts stored with the embeddings
 
         Returns:
-            embeddings (list): list containing np.arrays with word2vec embeddings
+            embeddings (np.array): float32 matrix containing one word2vec embedding per row, the sum of the token
+                embeddings
 
         """
         text_in_tokens = [arr.tolist() for arr in text_in_tokens]
@@ -97,39 +99,28 @@ class word2vec(object):
             self.update(text_in_tokens)
 
         self.is_transform = True
-        
-        w = self.get_wv()
-
-        embeddings = []
-        missing = []
-        for sentence in tqdm(text_in_tokens):
-            sen = []
-            for word in sentence:
-                try:
-                    sen.append(w[word])
-                except KeyError:
-                    #print(word + ' not in vocabular')
-                    missing.append(word)
-                    sen.append(np.zeros(100))
-
-            embeddings.append(np.array(sen).sum(axis=0))
-        #print(str(len(missing)) + ' Unknown words replaced with zero vecs\n')
+
+        embeddings = self._pool(text_in_tokens)
 
         if store is not None:
-            check_path_exists(os.path.dirname(store))
-            save(embeddings, store)
+            save_embeddings(embeddings, store, ids)
 
         return embeddings
 
-    def transform_tf_idf_weighted(self, text_in_tokens: pd.Series, tf_idf_weights: pd.Series, store: str = None):
+    def transform_tf_idf_weighted(self, text_in_tokens: pd.Series, tf_idf_weights, terms: pd.Index,
+                                  store: str = None, ids: list = None):
         """ Transforms series of preprocessed tokens to word2vec embeddings with tf/idf weights.
 
         Args:
             new_text_in_tokens (pd.Series): Series of preprocessed tokens
-            store (str): Path to store model to
+            tf_idf_weights (sp.csr_matrix): tf/idf matrix containing one row per text, e.g. from TFIDF.transform
+            terms (pd.Index): Token of every column of tf_idf_weights
+            store (str): Directory to store embeddings to
+            ids (list): IDs of the texts stored with the embeddings
 
         Returns:
-            embeddings (list): list containing np.arrays with word2vec embeddings with tf/idf weights.
+            embeddings (np.array): float32 matrix containing one word2vec embedding per row, the tf/idf weighted
+                mean of the token embeddings
 
         """
         text_in_tokens = [arr.tolist() for arr in text_in_tokens]
@@ -139,38 +130,59 @@ class word2vec(object):
             self.update(text_in_tokens)
 
         self.is_transform = True
-        
-        w = self.get_wv()
-
-        embeddings = []
-        missing = []
-        for count, sentence in enumerate(tqdm(text_in_tokens)):
-            sen = []
-            weight_sum = 0
-            sen_token_weights = tf_idf_weights[count]
-
-            for word in sentence:
-                try:
-                    token_weight = sen_token_weights[word]
-                    weight_sum += token_weight
-                    w2vembedding = w[word]
-                    
-                    weighted_embedding = token_weight*w2vembedding
-                    sen.append(weighted_embedding)
-                    
-                except KeyError:
-                    #print(word + ' not in vocabular')
-                    missing.append(word)
-                    sen.append(np.zeros(100))
-            try:
-                sen /= weight_sum
-            except Exception:
-                LOGGER.debug('Division by zero')
-            embeddings.append(np.array(sen).sum(axis=0))
+
+        embeddings = self._pool(text_in_tokens, sp.csr_matrix(tf_idf_weights), terms)
 
         if store is not None:
-            check_path_exists(os.path.dirname(store))
-            save(embeddings, store)
+            save_embeddings(embeddings, store, ids)
+
+        return embeddings
+
+    def _pool(self, text_in_tokens: list, weights=None, terms: pd.Index = None, chunk_size: int = 65536):
+        """ Sums the word vectors of every text, weighted and divided by the sum of weights if weights are given.
+
+        The tokens of all texts are mapped to rows of the word vectors at once and pooled by a sparse
+        text x vocabulary matrix, which is multiplied with the word vectors in chunks of texts. Every occurrence
+        of a token is weighted by its weight in the text.
+
+        Args:
+            text_in_tokens (list): Lists of preprocessed tokens
+            weights (sp.csr_matrix): Weight matrix containing one row per text and one column per token of terms
+            terms (pd.Index): Token of every column of weights
+            chunk_size (int): Number of texts pooled at once
+
+        Returns:
+            embeddings (np.array): float32 matrix containing one embedding per text
+
+        """
+        wv = self.embedding.wv
+        vocabulary = pd.Index(wv.index_to_key)
+        lengths = np.fromiter((len(tokens) for tokens in text_in_tokens), dtype=np.int64, count=len(text_in_tokens))
+        tokens = np.empty(lengths.sum(), dtype=object)
+        tokens[:] = [token for text in text_in_tokens for token in text]
+
+        rows = vocabulary.get_indexer(tokens)
+        known = rows >= 0
+        LOGGER.debug(f'{(~known).sum()} unknown tokens replaced with zero vectors')
+
+        texts = np.repeat(np.arange(len(text_in_tokens)), lengths)
+        pooling = sp.csr_matrix((np.ones(known.sum(), dtype=np.float32), (texts[known], rows[known])),
+                                shape=(len(text_in_tokens), len(vocabulary)))
+
+        if weights is not None:
+            columns = vocabulary.get_indexer(terms)
+            mapping = sp.csr_matrix((np.ones((columns >= 0).sum(), dtype=np.float32),
+                                     (np.flatnonzero(columns >= 0), columns[columns >= 0])),
+                                    shape=(len(terms), len(vocabulary)))
+            pooling = pooling.multiply(weights @ mapping).tocsr()
+
+        embeddings = np.zeros((len(text_in_tokens), wv.vector_size), dtype=np.float32)
+        for start in tqdm(range(0, len(text_in_tokens), chunk_size)):
+            embeddings[start:start + chunk_size] = pooling[start:start + chunk_size] @ wv.vectors
+
+        if weights is not None:
+            weight_sums = np.asarray(pooling.sum(axis=1)).ravel()
+            np.divide(embeddings, weight_sums[:, None], out=embeddings, where=weight_sums[:, None] > 0)
 
         return embeddings
 
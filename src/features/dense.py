@@ -0,0 +1,156 @@
+import numpy as np
+import scipy.sparse as sp
+import logging
+from tqdm import tqdm
+
+LOGGER = logging.getLogger('dense')
+
+
+class DenseIndex(object):
+    """ A class to retrieve passages by cosine similarity of their embeddings.
+
+    Small collections are searched exhaustively. Larger collections are split into an inverted file (IVF):
+    spherical k-means clusters the embeddings and a query only scores the passages of the nprobe clusters with
+    the closest centroids. The passages of cluster c are list_rows[list_offsets[c]:list_offsets[c + 1]].
+
+    Attributes:
+        bert (Bert): Encodes query texts, queries have to be passed as embeddings if None
+        clusters (int): Number of clusters, 4 * sqrt(number of passages) if None
+        nprobe (int): Number of clusters searched per query, more improves recall and costs latency
+        exact_threshold (int): Collections up to this size are searched exhaustively
+        iterations (int): Number of k-means iterations
+        chunk_size (int): Number of embeddings scored at once
+
+    Methods:
+    fit(embeddings: np.array):
+        Builds the index
+    search(query, k: int = 10, nprobe: int = None):
+        Returns the top-k passages for a query text or embedding
+    """
+
+    centroids = None
+    list_offsets = None
+    list_rows = None
+
+    def __init__(self, bert=None, clusters: int = None, nprobe: int = 8, exact_threshold: int = 50000,
+                 iterations: int = 10, chunk_size: int = 65536, seed: int = 42):
+        """ Constructs an empty index.
+
+        Args:
+            bert (Bert): Encodes query texts, queries have to be passed as embeddings if None
+            clusters (int): Number of clusters, 4 * sqrt(number of passages) if None
+            nprobe (int): Number of clusters searched per query
+            exact_threshold (int): Collections up to this size are searched exhaustively
+            iterations (int): Number of k-means iterations
+            chunk_size (int): Number of embeddings scored at once
+            seed (int): Seed of the k-means initialization
+
+        """
+        self.bert = bert
+        self.clusters = clusters
+        self.nprobe = nprobe
+        self.exact_threshold = exact_threshold
+        self.iterations = iterations
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.embeddings = None
+        self.norms = None
+
+    def fit(self, embeddings: np.ndarray):
+        """ Builds the index. The embeddings are referenced, not copied, so memory-mapped matrices stay on disk.
+
+        Args:
+            embeddings (np.array): Matrix containing one passage embedding per row
+
+        Returns:
+            self (DenseIndex): Fitted index
+
+        """
+        self.embeddings = embeddings
+        self.norms = np.concatenate([np.linalg.norm(np.asarray(embeddings[start:start + self.chunk_size],
+                                                               dtype=np.float32), axis=1)
+                                     for start in range(0, len(embeddings), self.chunk_size)] + [np.zeros(0)])
+        self.norms[self.norms == 0] = 1
+
+        if len(embeddings) <= self.exact_threshold:
+            self.centroids = None
+            LOGGER.info(f'Searching {len(embeddings)} embeddings exhaustively')
+            return self
+
+        clusters = self.clusters if self.clusters is not None else int(4 * np.sqrt(len(embeddings)))
+        rng = np.random.default_rng(self.seed)
+        sample = np.sort(rng.choice(len(embeddings), min(len(embeddings), 32 * clusters), replace=False))
+        self.centroids = self._kmeans(self._normalized(sample), clusters, rng)
+
+        assignments = np.concatenate([self._assign(self._normalized(np.arange(start, min(
+            start + self.chunk_size, len(embeddings)))), self.centroids)
+            for start in tqdm(range(0, len(embeddings), self.chunk_size))])
+        self.list_rows = np.argsort(assignments, kind='stable').astype(np.int64)
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=clusters))])
+        LOGGER.info(f'Indexed {len(embeddings)} embeddings in {clusters} clusters')
+
+        return self
+
+    def search(self, query, k: int = 10, nprobe: int = None):
+        """ Returns the top-k passages for a query.
+
+        Args:
+            query (str or np.array): Query text, encoded with bert, or query embedding
+            k (int): Number of passages to return
+            nprobe (int): Number of clusters searched, self.nprobe if None
+
+        Returns:
+            documents (np.array): Row positions into the embeddings, best first
+            scores (np.array): Cosine similarity per returned passage
+
+        """
+        assert self.embeddings is not None, 'Fit the index first'
+
+        if isinstance(query, str):
+            assert self.bert is not None, 'Pass a Bert object to search query texts'
+            query = self.bert.model.encode([query], convert_to_numpy=True)[0]
+        query = np.asarray(query, dtype=np.float32)
+        query = query / max(np.linalg.norm(query), np.finfo(np.float32).tiny)
+
+        if self.centroids is None:
+            candidates = np.arange(len(self.embeddings))
+        else:
+            nprobe = min(self.nprobe if nprobe is None else nprobe, len(self.centroids))
+            probes = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+            candidates = np.sort(np.concatenate([self.list_rows[self.list_offsets[c]:self.list_offsets[c + 1]]
+                                                 for c in probes]))
+
+        scores = np.concatenate([self._normalized(candidates[start:start + self.chunk_size]) @ query
+                                 for start in range(0, len(candidates), self.chunk_size)] + [np.zeros(0)])
+        if len(candidates) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            candidates, scores = candidates[top], scores[top]
+        order = np.lexsort((candidates, -scores))
+
+        return candidates[order], scores[order]
+
+    def _normalized(self, rows: np.ndarray):
+        """ Returns the given rows of the embeddings scaled to unit length. """
+        return np.asarray(self.embeddings[rows], dtype=np.float32) / self.norms[rows, None]
+
+    def _kmeans(self, vectors: np.ndarray, clusters: int, rng: np.random.Generator):
+        """ Clusters unit vectors with spherical k-means and returns the unit length centroids. """
+        centroids = vectors[rng.choice(len(vectors), clusters, replace=False)]
+
+        for _ in range(self.iterations):
+            assignments = self._assign(vectors, centroids)
+            membership = sp.csr_matrix((np.ones(len(vectors), dtype=np.float32),
+                                        (assignments, np.arange(len(vectors)))), shape=(clusters, len(vectors)))
+            sums = np.asarray(membership @ vectors)
+            norms = np.linalg.norm(sums, axis=1)
+            filled = norms > 0
+            centroids[filled] = sums[filled] / norms[filled, None]
+
+        return centroids
+
+    @staticmethod
+    def _assign(vectors: np.ndarray, centroids: np.ndarray):
+        """ Returns the closest centroid of every vector, scoring at most 2 ** 24 vector-centroid pairs at once. """
+        step = max(1, 2 ** 24 // len(centroids))
+        return np.concatenate([np.argmax(vectors[start:start + step] @ centroids.T, axis=1)
+                               for start in range(0, len(vectors), step)] + [np.zeros(0, dtype=np.int64)])
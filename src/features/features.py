@@ -3,6 +3,7 @@ from src.data.preprocessing import tokenization
 import nltk
 from textblob import TextBlob
 import numpy as np
+import scipy.sparse as sp
 
 
 def cosine_similarity_score(embedding_1: list, embedding_2: list):
@@ -47,19 +48,90 @@ def manhattan_distance_score(embedding_1: list, embedding_2: list):
     return manhattan_distances(embedding_1, embedding_2)[0][0]
 
 
+def similarity_scores(embeddings_1, embeddings_2, positions_1, positions_2, chunk_size: int = 10000):
+    """ Calculates cosine similarity, euclidean and manhattan distance for many pairs of embeddings at once.
+
+    The pairs are given as aligned row positions into the two embedding matrices and are processed in chunks
+    of chunk_size rows to bound memory. If both matrices are sparse, the pairs are compared with row-wise CSR
+    arithmetic without densifying, otherwise sparse rows are densified chunk by chunk.
+
+    Args:
+        embeddings_1 (np.array): Matrix containing one embedding per row
+        embeddings_2 (np.array): Matrix containing one embedding per row
+        positions_1 (np.array): Row positions into embeddings_1
+        positions_2 (np.array): Row positions into embeddings_2, aligned with positions_1
+        chunk_size (int): Number of pairs processed at once
+
+    Returns:
+        cosine (np.array): Cosine similarity per pair
+        euclidean (np.array): Euclidean distance per pair
+        manhattan (np.array): Manhattan distance per pair
+
+    """
+    positions_1 = np.asarray(positions_1)
+    positions_2 = np.asarray(positions_2)
+    assert len(positions_1) == len(positions_2), 'Positions need to be aligned'
+
+    cosine = np.zeros(len(positions_1))
+    euclidean = np.zeros(len(positions_1))
+    manhattan = np.zeros(len(positions_1))
+
+    sparse = sp.issparse(embeddings_1) and sp.issparse(embeddings_2)
+
+    for start in range(0, len(positions_1), chunk_size):
+        end = start + chunk_size
+        if sparse:
+            embedding_1 = sp.csr_matrix(embeddings_1[positions_1[start:end]], dtype=np.float64)
+            embedding_2 = sp.csr_matrix(embeddings_2[positions_2[start:end]], dtype=np.float64)
+            difference_vectors = embedding_1 - embedding_2
+            squared = _row_sums(difference_vectors.multiply(difference_vectors))
+            manhattan[start:end] = _row_sums(abs(difference_vectors))
+            dot = _row_sums(embedding_1.multiply(embedding_2))
+            norms = np.sqrt(_row_sums(embedding_1.multiply(embedding_1)) *
+                            _row_sums(embedding_2.multiply(embedding_2)))
+        else:
+            embedding_1 = _dense_rows(embeddings_1, positions_1[start:end])
+            embedding_2 = _dense_rows(embeddings_2, positions_2[start:end])
+            difference_vectors = embedding_1 - embedding_2
+            squared = np.einsum('ij,ij->i', difference_vectors, difference_vectors)
+            manhattan[start:end] = np.abs(difference_vectors).sum(axis=1)
+            dot = np.einsum('ij,ij->i', embedding_1, embedding_2)
+            norms = np.linalg.norm(embedding_1, axis=1) * np.linalg.norm(embedding_2, axis=1)
+
+        euclidean[start:end] = np.sqrt(squared)
+        np.divide(dot, norms, out=cosine[start:end], where=norms != 0)
+
+    return cosine, euclidean, manhattan
+
+
+def _row_sums(matrix):
+    """ Returns the row sums of a sparse matrix as flat array. """
+    return np.asarray(matrix.sum(axis=1)).ravel()
+
+
+def _dense_rows(embeddings, positions):
+    """ Returns the given rows of a dense or sparse embedding matrix as dense float64 array. """
+    rows = embeddings[positions]
+    if sp.issparse(rows):
+        rows = rows.toarray()
+    return np.asarray(rows, dtype=np.float64)
+
+
 def jaccard(token_vector_1: list, token_vector_2: list):
     """ Calculates jaccard coefficient between two lists of tokens
 
     Args:
-        token_vector_1 (list): List contaning tokens
-        token_vector_2 (list): List contaning tokens
+        token_vector_1 (list): List contaning tokens or token ids
+        token_vector_2 (list): List contaning tokens or token ids
 
     Returns:
         (float): Jaccard coefficient as float
 
     """
-    intersect = set(token_vector_1).intersection(set(token_vector_2))
-    union = set(token_vector_1).union(set(token_vector_2))
+    token_set_1 = set(token_vector_1)
+    token_set_2 = set(token_vector_2)
+    intersect = token_set_1.intersection(token_set_2)
+    union = token_set_1.union(token_set_2)
     try:
         return len(intersect) / len(union)
     except ZeroDivisionError:
@@ -89,7 +161,7 @@ def words(sentence: str):
         (int): Number of words in a sentence as int
 
     """
-    tokens = list(tokenization(sentence))
+    tokens = tokenization(sentence)
     return len(tokens)
 
 
@@ -105,7 +177,7 @@ def POS(sentence: str):
         vetbs (int): Number of verbs
 
     """
-    tokens = list(tokenization(sentence))
+    tokens = tokenization(sentence)
     tags = nltk.pos_tag(tokens)
     nouns = len([tag[0] for tag in tags if tag[1].startswith('NN')])
     adj = len([tag[0] for tag in tags if tag[1].startswith('JJ')])
@@ -0,0 +1,87 @@
+import numpy as np
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+LOGGER = logging.getLogger('fusion')
+
+
+class FusionRetriever(object):
+    """ A class to merge the rankings of several first-stage retrievers, e.g. BM25 and a DenseIndex.
+
+    Every retriever is searched concurrently for its top depth passages, by threads that exist for the duration of
+    the search only. The lists are fused either by reciprocal rank fusion, sum of weight / (rrf_k + rank), or by
+    the sum of weighted min-max normalized scores. Passages found by several retrievers are counted once.
+
+    Attributes:
+        retrievers (list): Objects with a search(query, k) method returning row positions and scores
+        fusion (str): "rrf" for reciprocal rank fusion or "score" for normalized score fusion
+        depth (int): Number of passages retrieved per retriever, k if None
+        weights (list): Weight per retriever, 1 each if None
+        rrf_k (int): Rank offset of reciprocal rank fusion damping the influence of the top ranks
+
+    Methods:
+    search(query: tuple, k: int = 10):
+        Returns the top-k fused passages, the query holds one input per retriever
+    """
+
+    def __init__(self, retrievers: list, fusion: str = 'rrf', depth: int = None, weights: list = None,
+                 rrf_k: int = 60):
+        """ Constructs fusion retriever object.
+
+        Args:
+            retrievers (list): Objects with a search(query, k) method returning row positions and scores
+            fusion (str): "rrf" for reciprocal rank fusion or "score" for normalized score fusion
+            depth (int): Number of passages retrieved per retriever, k if None
+            weights (list): Weight per retriever, 1 each if None
+            rrf_k (int): Rank offset of reciprocal rank fusion
+
+        """
+        assert fusion in ['rrf', 'score'], f'Unknown fusion {fusion}'
+        assert weights is None or len(weights) == len(retrievers), 'Provide one weight per retriever'
+
+        self.retrievers = retrievers
+        self.fusion = fusion
+        self.depth = depth
+        self.weights = np.ones(len(retrievers)) if weights is None else np.asarray(weights, dtype=np.float64)
+        self.rrf_k = rrf_k
+
+    def search(self, query: tuple, k: int = 10):
+        """ Returns the top-k passages of the fused rankings.
+
+        Args:
+            query (tuple): One query input per retriever, e.g. preprocessed tokens and query text
+            k (int): Number of passages to return
+
+        Returns:
+            documents (np.array): Row positions into the collection, best first
+            scores (np.array): Fused score per returned passage
+
+        """
+        assert len(query) == len(self.retrievers), 'Provide one query input per retriever'
+
+        depth = max(k, self.depth) if self.depth is not None else k
+        with ThreadPoolExecutor(max_workers=len(self.retrievers)) as executor:
+            results = list(executor.map(lambda retriever, inputs: retriever.search(inputs, depth),
+                                        self.retrievers, query))
+
+        documents = np.concatenate([np.asarray(positions, dtype=np.int64) for positions, _ in results])
+        scores = np.concatenate([self._fusion_scores(np.asarray(scores, dtype=np.float64)) * weight
+                                 for (_, scores), weight in zip(results, self.weights)])
+
+        candidates, inverse = np.unique(documents, return_inverse=True)
+        scores = np.bincount(inverse.ravel(), weights=scores, minlength=len(candidates))
+        if len(candidates) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            candidates, scores = candidates[top], scores[top]
+        order = np.lexsort((candidates, -scores))
+
+        return candidates[order], scores[order]
+
+    def _fusion_scores(self, scores: np.ndarray):
+        """ Returns the contribution of every passage of one ranking, which is sorted best first. """
+        if self.fusion == 'rrf':
+            return 1 / (self.rrf_k + np.arange(1, len(scores) + 1))
+
+        if len(scores) == 0 or scores.max() == scores.min():
+            return np.ones(len(scores))
+        return (scores - scores.min()) / (scores.max() - scores.min())
@@ -7,9 +7,9 @@ from src.embeddings.bert import Bert
 from src.embeddings.tfidf import TFIDF
 from src.embeddings.glove import Glove
 from src.embeddings.word2vec import word2vec
-from src.features.features import cosine_similarity_score, euclidean_distance_score, manhattan_distance_score, jaccard, \
-    words, relative_difference, characters, difference, subjectivity, polarisation, POS
-from src.utils.utils import load
+from src.features.features import similarity_scores, jaccard, words, relative_difference, characters, difference, \
+    subjectivity, polarisation, POS
+from src.utils.utils import load_embeddings, load_embedding_ids
 from src.features.bm25 import BM25
 
 nltk.download('averaged_perceptron_tagger')
@@ -18,8 +18,46 @@ tqdm.pandas()
 LOGGER = logging.getLogger('generator')
 
 
+def index_ids(data: pd.DataFrame, column: str, ids):
+    """ Resolves IDs to row positions of a data frame using a hash index over one of its ID columns.
+
+    Duplicated IDs resolve to their first occurrence.
+
+    Args:
+        data (pd.DataFrame): Dataframe containing the ID column
+        column (str): Name of the ID column, e.g. "pID" or "qID"
+        ids (list): IDs to look up
+
+    Returns:
+        positions (np.array): Row positions of the IDs in data
+
+    """
+    unique = ~data[column].duplicated().values
+    index = pd.Index(data[column].values[unique])
+    positions = index.get_indexer(ids)
+    assert (positions >= 0).all(), f'{column} missing from data'
+
+    return np.flatnonzero(unique)[positions]
+
+
+def index_pairs(features: pd.DataFrame, collection: pd.DataFrame, queries: pd.DataFrame):
+    """ Resolves the query-collection combinations of the feature data to row positions.
+
+    Args:
+        features (pd.DataFrame): Dataframe containing feature data
+        collection (pd.DataFrame): Dataframe containing collection data
+        queries (pd.DataFrame): Dataframe containing queries data
+
+    Returns:
+        query_positions (np.array): Row positions of the qIDs in queries
+        passage_positions (np.array): Row positions of the pIDs in collection
+
+    """
+    return index_ids(queries, 'qID', features['qID']), index_ids(collection, 'pID', features['pID'])
+
+
 def create_all(features: pd.DataFrame, collection: pd.DataFrame, queries: pd.DataFrame, tfidf=None, glove=None,
-               bert=None, w2v=None):
+               bert=None, w2v=None, vocabulary=None):
     """ Creates all implemented embeddings (bert, glove, tfidf, word2vec)
         and features (cosine, euclidean, manhattan, jaccard, sentence, interpretation, BM25, POS).
 
@@ -31,6 +69,7 @@ def create_all(features: pd.DataFrame, collection: pd.DataFrame, queries: pd.Dat
         glove (Glove object): Creates new object of class Glove if None
         bert (Bert object): Creates new object of class Bert if None
         w2v (word2vec object): Creates new object of class word2vec if None
+        vocabulary (Vocabulary object): Vocabulary the preprocessed tokens are encoded with, None if not encoded
 
     Returns:
         features (pd.DataFrame): Dataframe containing feature data
@@ -38,24 +77,30 @@ def create_all(features: pd.DataFrame, collection: pd.DataFrame, queries: pd.Dat
     """
     tfidf, _ = create_tfidf_embeddings(collection, tfidf=tfidf, name='collection')
     create_tfidf_embeddings(queries, tfidf=tfidf, name='query')
-    glove, _ = create_glove_embeddings(collection, glove=glove, name='collection')
-    create_glove_embeddings(queries, glove=glove, name='query')
+    glove, _ = create_glove_embeddings(collection, glove=glove, name='collection', vocabulary=vocabulary)
+    create_glove_embeddings(queries, glove=glove, name='query', vocabulary=vocabulary)
     bert, _ = create_bert_embeddings(collection, bert=bert, name='collection')
     create_bert_embeddings(queries, bert=bert, name='query')
     w2v, _ = create_w2v_embeddings(collection, w2v=w2v, name='collection')
     create_w2v_embeddings(queries, w2v=w2v, name='query')
-    create_w2v_embeddings_tf_idf_weighted(collection, w2v=w2v, name="collection")
-    create_w2v_embeddings_tf_idf_weighted(queries, w2v=w2v, name="query")
-    features = create_w2v_feature(features, collection, queries)
-    features = create_w2v_tfidf_feature(features, collection, queries)
-    features = create_tfidf_feature(features, collection, queries)
-    features = create_bert_feature(features, collection, queries)
-    features = create_glove_feature(features, collection, queries)
-    features = create_jaccard_feature(features, collection, queries)
-    features = create_sentence_features(features, collection, queries)
-    features = create_interpretation_features(features, collection, queries)
-    features = create_BM2_feature(features, collection, queries)
-    return create_POS_features(features, collection, queries)
+    create_w2v_embeddings_tf_idf_weighted(collection, w2v=w2v, name="collection", tfidf=tfidf)
+    create_w2v_embeddings_tf_idf_weighted(queries, w2v=w2v, name="query", tfidf=tfidf)
+    positions = index_pairs(features, collection, queries)
+    features = create_w2v_feature(features, collection, queries, positions=positions)
+    features = create_w2v_tfidf_feature(features, collection, queries, positions=positions)
+    features = create_tfidf_feature(features, collection, queries, positions=positions)
+    features = create_bert_feature(features, collection, queries, positions=positions)
+    features = create_glove_feature(features, collection, queries, positions=positions)
+    features = create_jaccard_feature(features, collection, queries, positions=positions)
+    features = create_sentence_features(features, collection, queries, positions=positions)
+    features = create_interpretation_features(features, collection, queries, positions=positions)
+    features = create_BM2_feature(features, collection, queries, positions=positions)
+    return create_POS_features(features, collection, queries, positions=positions)
+
+
+def _ids(data: pd.DataFrame):
+    """ Returns the passage or query IDs of the rows of data. """
+    return data['pID'].values if 'pID' in data.columns else data['qID'].values
 
 
 def create_tfidf_embeddings(data: pd.DataFrame, tfidf=None, name: str = ''):
@@ -64,11 +109,11 @@ def create_tfidf_embeddings(data: pd.DataFrame, tfidf=None, name: str = ''):
     Args:
         data (pd.DataFrame): Dataframe containing data to be embedded
         tfidf (str): Creates new object of class tfidf if None
-        name (str): Adds string to name of the .pkl file created and stored of the data data frame
+        name (str): Adds string to name of the embeddings directory created and stored of the data data frame
 
     Returns:
         tfidf (TFIDF object): Object of class TFIDF
-        data (pd.DataFrame): Dataframe data with new column "preprocessed" appended
+        data (pd.DataFrame): Dataframe data, the sparse tfidf matrix is stored to "tfidf_<name>_embeddings"
 
     """
     if tfidf is None:
@@ -76,20 +121,21 @@ def create_tfidf_embeddings(data: pd.DataFrame, tfidf=None, name: str = ''):
         tfidf.fit(
             data['preprocessed']
         )
-    data['tfidf'] = tfidf.transform(
+    tfidf.transform(
         data['preprocessed'],
-        f"data/embeddings/tfidf_{name}_embeddings.pkl")
+        f"data/embeddings/tfidf_{name}_embeddings", ids=_ids(data))
 
     return tfidf, data
 
 
-def create_glove_embeddings(data: pd.DataFrame, glove=None, name: str = ''):
+def create_glove_embeddings(data: pd.DataFrame, glove=None, name: str = '', vocabulary=None):
     """ Creates glove embeddings
 
     Args:
         data (pd.DataFrame): Dataframe containing data to be embedded
         glove (str): Creates new object of class Glove if None
-        name (str): Adds string to name of the .pkl file created and stored of the data Dataframe
+        name (str): Adds string to name of the embeddings directory created and stored of the data Dataframe
+        vocabulary (Vocabulary object): Decodes the preprocessed token ids to tokens if not None
 
     Returns:
         glove (Glove object): Object of class Glove
@@ -99,9 +145,10 @@ def create_glove_embeddings(data: pd.DataFrame, glove=None, name: str = ''):
     if glove is None:
         glove = Glove()
 
-    data['glove'] = glove.transform(
-        data['preprocessed'],
-        f"data/embeddings/glove_{name}_embeddings.pkl")
+    tokens = data['preprocessed'] if vocabulary is None else data['preprocessed'].apply(vocabulary.decode)
+    data['glove'] = list(glove.transform(
+        tokens,
+        f"data/embeddings/glove_{name}_embeddings", ids=_ids(data)))
 
     return glove, data
 
@@ -112,7 +159,7 @@ def create_glove_embeddings_tf_idf_weighted(data: pd.DataFrame, glove=None, name
     Args:
         data (pd.DataFrame): Dataframe containing data to be embedded
         glove (str): Creates new object of class Glove if None
-        name (str): Adds string to name of the .pkl file created and stored of the data Dataframe
+        name (str): Adds string to name of the embeddings directory created and stored of the data Dataframe
 
     Returns:
         glove (Glove object): Object of class Glove
@@ -124,7 +171,7 @@ def create_glove_embeddings_tf_idf_weighted(data: pd.DataFrame, glove=None, name
 
     data['glove_tfidf'] = glove.transform_tfidfweighted(
         data['preprocessed'], data['tfidf'],
-        f"data/embeddings/glove_tf_idf_{name}_embeddings.pkl")
+        f"data/embeddings/glove_tf_idf_{name}_embeddings", ids=_ids(data))
 
     return glove, data
 
@@ -135,7 +182,7 @@ def create_bert_embeddings(data: pd.DataFrame, bert=None, name: str = ''):
     Args:
         data (pd.DataFrame): Dataframe containing data to be embedded
         bert (str): Creates new object of class Bert if None
-        name (str): Adds string to name of the .pkl file created and stored of the data Dataframe
+        name (str): Adds string to name of the embeddings directory created and stored of the data Dataframe
 
     Returns:
         bert (Bert object): Object of class Bert
@@ -151,9 +198,9 @@ def create_bert_embeddings(data: pd.DataFrame, bert=None, name: str = ''):
     if name == "query" or name == "query_test":
         column_name = "Query"
 
-    data['bert'] = bert.transform(
+    data['bert'] = list(bert.transform(
         data[column_name],
-        f"data/embeddings/bert_{name}_embeddings.pkl")
+        f"data/embeddings/bert_{name}_embeddings", ids=_ids(data)))
 
     return bert, data
 
@@ -164,7 +211,7 @@ def create_w2v_embeddings(data: pd.DataFrame, w2v=None, name: str = ''):
     Args:
         data (pd.DataFrame): Dataframe containing data to be embedded
         w2v (str): Creates new object of class word2vec if None
-        name (str): Adds string to name of the .pkl file created and stored of the data Dataframe
+        name (str): Adds string to name of the embeddings directory created and stored of the data Dataframe
 
     Returns:
         w2v (word2vec object): Object of class word2vec
@@ -174,19 +221,21 @@ def create_w2v_embeddings(data: pd.DataFrame, w2v=None, name: str = ''):
     if w2v is None:
         w2v = word2vec()
 
-    data['w2v'] = w2v.transform(data['preprocessed'],
-                                f"data/embeddings/w2v_{name}_embeddings.pkl")
+    data['w2v'] = list(w2v.transform(data['preprocessed'],
+                                     f"data/embeddings/w2v_{name}_embeddings", ids=_ids(data)))
 
     return w2v, data
 
 
-def create_w2v_embeddings_tf_idf_weighted(data: pd.DataFrame, w2v=None, name: str = ''):
+def create_w2v_embeddings_tf_idf_weighted(data: pd.DataFrame, w2v=None, name: str = '', tfidf=None):
     """ Creates weighted tfidf word2vec embeddings
 
     Args:
         data (pd.DataFrame): Dataframe containing data to be embedded
         w2v (str): Creates new object of class word2vec if None
-        name (str): Adds string to name of the .pkl file created and stored of the data Dataframe
+        name (str): Adds string to name of the embeddings directory created and stored of the data Dataframe
+        tfidf (TFIDF object): TFIDF the "tfidf_<name>_embeddings" were created with, loaded from
+            "models/tfidf.pkl" if None
 
     Returns:
         w2v (word2vec object): Object of class word2vec
@@ -195,418 +244,325 @@ def create_w2v_embeddings_tf_idf_weighted(data: pd.DataFrame, w2v=None, name: st
     """
     if w2v is None:
         w2v = word2vec()
+    if tfidf is None:
+        tfidf = TFIDF('models/tfidf.pkl')
+
+    path = f"data/embeddings/tfidf_{name}_embeddings"
+    tfidf_matrix = load_embeddings(path)
+    stored_ids = load_embedding_ids(path)
+    if stored_ids is not None:
+        tfidf_matrix = tfidf_matrix[index_ids(pd.DataFrame({'ID': stored_ids}), 'ID', _ids(data))]
 
-    data['w2v_tfidf'] = w2v.transform_tf_idf_weighted(data['preprocessed'], data['tfidf'],
-                                                      f"data/embeddings/w2v_tfidf_{name}_embeddings.pkl")
+    data['w2v_tfidf'] = list(w2v.transform_tf_idf_weighted(
+        data['preprocessed'], tfidf_matrix, tfidf.terms, f"data/embeddings/w2v_tfidf_{name}_embeddings",
+        ids=_ids(data)))
 
     return w2v, data
 
 
 def create_w2v_feature(features: pd.DataFrame, collection: pd.DataFrame, queries: pd.DataFrame,
-                       path_collection: str = 'data/embeddings/w2v_collection_embeddings.pkl',
-                       path_query: str = 'data/embeddings/w2v_query_embeddings.pkl'):
+                       path_collection: str = 'data/embeddings/w2v_collection_embeddings',
+                       path_query: str = 'data/embeddings/w2v_query_embeddings', positions: tuple = None):
     """ Creates word2vec features (cosine, euclidean, manhattan)
 
     Args:
         features (pd.DataFrame): Dataframe containing feature data
         collection (pd.DataFrame): Dataframe containing collection data
         queries (pd.DataFrame): Dataframe containing queries data
-        path_collection (str): Path to "w2v_collection_embeddings.pkl" file
-        path_query (str): Path to "w2v_query_embeddings.pkl" file
+        path_collection (str): Path to "w2v_collection_embeddings" directory
+        path_query (str): Path to "w2v_query_embeddings" directory
+        positions (tuple): Row positions from index_pairs, created if None
 
 
     Returns:
         features (pd.DataFrame): Dataframe "features" with new columns "w2v_cosine", "w2v_euclidean", "w2v_manhattan" appended
 
     """
-    embeddings = np.array(load(path_collection))
-    embeddings_queries = np.array(load(path_query))
-
-    features['w2v_cosine'] = features.progress_apply(lambda qrel:
-                                                     cosine_similarity_score(embeddings_queries[
-                                                                                 queries[
-                                                                                     queries[
-                                                                                         'qID'] == qrel.qID].index],
-                                                                             embeddings[collection[
-                                                                                 collection[
-                                                                                     'pID'] == qrel.pID].index]),
-                                                     axis=1)
-    features['w2v_euclidean'] = features.progress_apply(lambda qrel:
-                                                        euclidean_distance_score(embeddings_queries[
-                                                                                     queries[
-                                                                                         queries[
-                                                                                             'qID'] == qrel.qID].index],
-                                                                                 embeddings[
-                                                                                     collection[
-                                                                                         collection[
-                                                                                             'pID'] == qrel.pID].index]),
-                                                        axis=1)
-    features['w2v_manhattan'] = features.progress_apply(lambda qrel:
-                                                        manhattan_distance_score(embeddings_queries[
-                                                                                     queries[
-                                                                                         queries[
-                                                                                             'qID'] == qrel.qID].index],
-                                                                                 embeddings[
-                                                                                     collection[
-                                                                                         collection[
-                                                                                             'pID'] == qrel.pID].index]),
-                                                        axis=1)
+    embeddings = load_embeddings(path_collection)
+    embeddings_queries = load_embeddings(path_query)
 
-    return features
+    return _create_similarity_features(features, collection, queries, 'w2v', embeddings, embeddings_queries,
+                                       positions)
 
 
 def create_w2v_tfidf_feature(features: pd.DataFrame, collection: pd.DataFrame, queries: pd.DataFrame,
-                             path_collection: str = 'data/embeddings/w2v_tfidf_collection_embeddings.pkl',
-                             path_query: str = 'data/embeddings/w2v_tfidf_query_embeddings.pkl'):
+                             path_collection: str = 'data/embeddings/w2v_tfidf_collection_embeddings',
+                             path_query: str = 'data/embeddings/w2v_tfidf_query_embeddings',
+                             positions: tuple = None):
     """ Creates tfidf weighted word2vec features (cosine, euclidean, manhattan)
 
     Args:
         features (pd.DataFrame): Dataframe containing feature data
         collection (pd.DataFrame): Dataframe containing collection data
         queries (pd.DataFrame): Dataframe containing queries data
-        path_collection (str): Path to "w2v_tfidf_collection_embeddings.pkl" file
-        path_query (str): Path to "w2v_tfidf_query_embeddings.pkl" file
+        path_collection (str): Path to "w2v_tfidf_collection_embeddings" directory
+        path_query (str): Path to "w2v_tfidf_query_embeddings" directory
+        positions (tuple): Row positions from index_pairs, created if None
 
 
     Returns:
         features (pd.DataFrame): Dataframe "features" with new columns "w2v_tfidf_cosine", "w2v_tfidf_euclidean", "w2v_tfidf_manhattan" appended
 
     """
-    embeddings = np.array(load(path_collection))
-    embeddings_queries = np.array(load(path_query))
-
-    features['w2v_tfidf_cosine'] = features.progress_apply(lambda qrel:
-                                                           cosine_similarity_score(embeddings_queries[
-                                                                                       queries[
-                                                                                           queries[
-                                                                                               'qID'] == qrel.qID].index],
-                                                                                   embeddings[collection[
-                                                                                       collection[
-                                                                                           'pID'] == qrel.pID].index]),
-                                                           axis=1)
-    features['w2v_tfidf_euclidean'] = features.progress_apply(lambda qrel:
-                                                              euclidean_distance_score(embeddings_queries[
-                                                                                           queries[
-                                                                                               queries[
-                                                                                                   'qID'] == qrel.qID].index],
-                                                                                       embeddings[
-                                                                                           collection[
-                                                                                               collection[
-                                                                                                   'pID'] == qrel.pID].index]),
-                                                              axis=1)
-    features['w2v_tfidf_manhattan'] = features.progress_apply(lambda qrel:
-                                                              manhattan_distance_score(embeddings_queries[
-                                                                                           queries[
-                                                                                               queries[
-                                                                                                   'qID'] == qrel.qID].index],
-                                                                                       embeddings[
-                                                                                           collection[
-                                                                                               collection[
-                                                                                                   'pID'] == qrel.pID].index]),
-                                                              axis=1)
+    embeddings = load_embeddings(path_collection)
+    embeddings_queries = load_embeddings(path_query)
 
-    return features
+    return _create_similarity_features(features, collection, queries, 'w2v_tfidf', embeddings, embeddings_queries,
+                                       positions)
 
 
 def create_tfidf_feature(features: pd.DataFrame, collection: pd.DataFrame, queries: pd.DataFrame,
-                         path_collection: str = 'data/embeddings/tfidf_collection_embeddings.pkl',
-                         path_query: str = 'data/embeddings/tfidf_query_embeddings.pkl'):
+                         path_collection: str = 'data/embeddings/tfidf_collection_embeddings',
+                         path_query: str = 'data/embeddings/tfidf_query_embeddings', positions: tuple = None):
     """ Creates tfidf features (cosine, euclidean, manhattan)
 
     Args:
         features (pd.DataFrame): Dataframe containing feature data
         collection (pd.DataFrame): Dataframe containing collection data
         queries (pd.DataFrame): Dataframe containing queries data
-        path_collection (str): Path to "tfidf_collection_embeddings.pkl" file
-        path_query (str): Path to "tfidf_query_embeddings.pkl" file
+        path_collection (str): Path to "tfidf_collection_embeddings" directory
+        path_query (str): Path to "tfidf_query_embeddings" directory
+        positions (tuple): Row positions from index_pairs, created if None
 
 
     Returns:
         features (pd.DataFrame): Dataframe "features" with new columns "tfidf_cosine", "tfidf_euclidean", "tfidf_manhattan" appended
 
     """
-    embeddings = load(path_collection)
-    embeddings_queries = load(path_query)
-
-    features['tfidf_cosine'] = features.progress_apply(lambda qrel:
-                                                       cosine_similarity_score(embeddings_queries[
-                                                                                   queries[
-                                                                                       queries[
-                                                                                           'qID'] == qrel.qID].index],
-                                                                               embeddings[collection[
-                                                                                   collection[
-                                                                                       'pID'] == qrel.pID].index]),
-                                                       axis=1)
-    features['tfidf_euclidean'] = features.progress_apply(lambda qrel:
-                                                          euclidean_distance_score(embeddings_queries[
-                                                                                       queries[
-                                                                                           queries[
-                                                                                               'qID'] == qrel.qID].index],
-                                                                                   embeddings[
-                                                                                       collection[
-                                                                                           collection[
-                                                                                               'pID'] == qrel.pID].index]),
-                                                          axis=1)
-    features['tfidf_manhattan'] = features.progress_apply(lambda qrel:
-                                                          manhattan_distance_score(embeddings_queries[
-                                                                                       queries[
-                                                                                           queries[
-                                                                                               'qID'] == qrel.qID].index],
-                                                                                   embeddings[
-                                                                                       collection[
-                                                                                           collection[
-                                                                                               'pID'] == qrel.pID].index]),
-                                                          axis=1)
+    embeddings = load_embeddings(path_collection)
+    embeddings_queries = load_embeddings(path_query)
 
-    return features
+    return _create_similarity_features(features, collection, queries, 'tfidf', embeddings, embeddings_queries,
+                                       positions)
 
 
 def create_glove_feature(features: pd.DataFrame, collection: pd.DataFrame, queries: pd.DataFrame,
-                         path_collection: str = 'data/embeddings/glove_collection_embeddings.pkl',
-                         path_query: str = 'data/embeddings/glove_query_embeddings.pkl'):
+                         path_collection: str = 'data/embeddings/glove_collection_embeddings',
+                         path_query: str = 'data/embeddings/glove_query_embeddings', positions: tuple = None):
     """ Creates glove features (cosine, euclidean, manhattan)
 
     Args:
         features (pd.DataFrame): Dataframe containing feature data
         collection (pd.DataFrame): Dataframe containing collection data
         queries (pd.DataFrame): Dataframe containing queries data
-        path_collection (str): Path to "glove_collection_embeddings.pkl" file
-        path_query (str): Path to "glove_query_embeddings.pkl" file
+        path_collection (str): Path to "glove_collection_embeddings" directory
+        path_query (str): Path to "glove_query_embeddings" directory
+        positions (tuple): Row positions from index_pairs, created if None
 
 
     Returns:
         features (pd.DataFrame): Dataframe "features" with new columns "glove_cosine", "glove_euclidean", "glove_manhattan" appended
 
     """
-    embeddings = np.array(load(path_collection))
-    embeddings_queries = np.array(load(path_query))
-
-    features['glove_cosine'] = features.progress_apply(lambda qrel:
-                                                       cosine_similarity_score(embeddings_queries[
-                                                                                   queries[
-                                                                                       queries[
-                                                                                           'qID'] == qrel.qID].index],
-                                                                               embeddings[
-                                                                                   collection[
-                                                                                       collection[
-                                                                                           'pID'] == qrel.pID].index]),
-                                                       axis=1)
-    features['glove_euclidean'] = features.progress_apply(lambda qrel:
-                                                          euclidean_distance_score(embeddings_queries[
-                                                                                       queries[
-                                                                                           queries[
-                                                                                               'qID'] == qrel.qID].index],
-                                                                                   embeddings[
-                                                                                       collection[
-                                                                                           collection[
-                                                                                               'pID'] == qrel.pID].index]),
-                                                          axis=1)
-    features['glove_manhattan'] = features.progress_apply(lambda qrel:
-                                                          manhattan_distance_score(embeddings_queries[
-                                                                                       queries[
-                                                                                           queries[
-                                                                                               'qID'] == qrel.qID].index],
-                                                                                   embeddings[
-                                                                                       collection[
-                                                                                           collection[
-                                                                                               'pID'] == qrel.pID].index]),
-                                                          axis=1)
+    embeddings = load_embeddings(path_collection)
+    embeddings_queries = load_embeddings(path_query)
 
-    return features
+    return _create_similarity_features(features, collection, queries, 'glove', embeddings, embeddings_queries,
+                                       positions)
 
 
 def create_bert_feature(features: pd.DataFrame, collection: pd.DataFrame, queries: pd.DataFrame,
-                        path_collection: str = 'data/embeddings/bert_collection_embeddings.pkl',
-                        path_query: str = 'data/embeddings/bert_query_embeddings.pkl'):
+                        path_collection: str = 'data/embeddings/bert_collection_embeddings',
+                        path_query: str = 'data/embeddings/bert_query_embeddings', positions: tuple = None):
     """ Creates bert features (cosine, euclidean, manhattan)
 
     Args:
         features (pd.DataFrame): Dataframe containing feature data
         collection (pd.DataFrame): Dataframe containing collection data
         queries (pd.DataFrame): Dataframe containing queries data
-        path_collection (str): Path to "bert_collection_embeddings.pkl" file
-        path_query (str): Path to "bert_query_embeddings.pkl" file
+        path_collection (str): Path to "bert_collection_embeddings" directory
+        path_query (str): Path to "bert_query_embeddings" directory
+        positions (tuple): Row positions from index_pairs, created if None
 
 
     Returns:
         features (pd.DataFrame): Dataframe "features" with new columns "bert_cosine", "bert_euclidean", "bert_manhattan" appended
 
     """
-    embeddings = np.array(load(path_collection))
-
-    embeddings_queries = np.array(load(path_query))
-
-    features['bert_cosine'] = features.progress_apply(lambda qrel:
-                                                      cosine_similarity_score(embeddings_queries[
-                                                                                  queries[
-                                                                                      queries[
-                                                                                          'qID'] == qrel.qID].index],
-                                                                              embeddings[
-                                                                                  collection[
-                                                                                      collection[
-                                                                                          'pID'] == qrel.pID].index]),
-                                                      axis=1)
-    features['bert_euclidean'] = features.progress_apply(lambda qrel:
-                                                         euclidean_distance_score(embeddings_queries[
-                                                                                      queries[
-                                                                                          queries[
-                                                                                              'qID'] == qrel.qID].index],
-                                                                                  embeddings[
-                                                                                      collection[
-                                                                                          collection[
-                                                                                              'pID'] == qrel.pID].index]),
-                                                         axis=1)
-    features['bert_manhattan'] = features.progress_apply(lambda qrel:
-                                                         manhattan_distance_score(embeddings_queries[
-                                                                                      queries[
-                                                                                          queries[
-                                                                                              'qID'] == qrel.qID].index],
-                                                                                  embeddings[
-                                                                                      collection[
-                                                                                          collection[
-                                                                                              'pID'] == qrel.pID].index]),
-                                                         axis=1)
+    embeddings = load_embeddings(path_collection)
+
+    embeddings_queries = load_embeddings(path_query)
+
+    return _create_similarity_features(features, collection, queries, 'bert', embeddings, embeddings_queries,
+                                       positions)
+
+
+def _create_similarity_features(features: pd.DataFrame, collection: pd.DataFrame, queries: pd.DataFrame, name: str,
+                                embeddings, embeddings_queries, positions: tuple = None):
+    """ Appends cosine, euclidean and manhattan columns for the given embeddings to the feature data. """
+    query_positions, passage_positions = index_pairs(features, collection, queries) if positions is None \
+        else positions
+    cosine, euclidean, manhattan = similarity_scores(embeddings_queries, embeddings, query_positions,
+                                                     passage_positions)
+
+    features[f'{name}_cosine'] = cosine
+    features[f'{name}_euclidean'] = euclidean
+    features[f'{name}_manhattan'] = manhattan
 
     return features
 
 
-def create_jaccard_feature(features: pd.DataFrame, collection: pd.DataFrame, queries: pd.DataFrame):
+def create_jaccard_feature(features: pd.DataFrame, collection: pd.DataFrame, queries: pd.DataFrame,
+                           positions: tuple = None):
     """ Creates jaccard features for query-collection combinations
 
     Args:
         features (pd.DataFrame): Dataframe containing feature data
         collection (pd.DataFrame): Dataframe containing collection data
         queries (pd.DataFrame): Dataframe containing queries data
+        positions (tuple): Row positions from index_pairs, created if None
 
     Returns:
         features (pd.DataFrame): Dataframe "features" with new column "jaccard" appended
 
     """
-    features['jaccard'] = features.progress_apply(
-        lambda qrel: jaccard(collection[collection['pID'] == qrel['pID']]['preprocessed'].iloc[0],
-                             queries[queries['qID'] == qrel['qID']]['preprocessed'].iloc[0]),
-        axis=1)
+    query_positions, passage_positions = index_pairs(features, collection, queries) if positions is None \
+        else positions
+    passages = collection['preprocessed'].values
+    query_tokens = queries['preprocessed'].values
+
+    features['jaccard'] = [jaccard(passages[p], query_tokens[q])
+                           for q, p in tqdm(zip(query_positions, passage_positions), total=len(features))]
 
     return features
 
 
-def create_sentence_features(features: pd.DataFrame, collection: pd.DataFrame, queries: pd.DataFrame):
+def create_sentence_features(features: pd.DataFrame, collection: pd.DataFrame, queries: pd.DataFrame,
+                             positions: tuple = None):
     """ Creates sentence features for query-collection combinations (words_difference, words_rel_difference, char_difference, char_rel_difference)
 
     Args:
         features (pd.DataFrame): Dataframe containing feature data
         collection (pd.DataFrame): Dataframe containing collection data
         queries (pd.DataFrame): Dataframe containing queries data
+        positions (tuple): Row positions from index_pairs, created if None
 
     Returns:
         features (pd.DataFrame): Dataframe "features" with new columns "words_doc", "words_query", "words_difference", "words_rel_difference"
         "char_doc", "char_query", "char_difference", "char_rel_difference" appended
 
     """
-    features['words_doc'] = features.progress_apply(
-        lambda qrel: words(collection[collection['pID'] == qrel['pID']]['Passage'].iloc[0]),
-        axis=1)
-    features['words_query'] = features.progress_apply(
-        lambda qrel: words(queries[queries['qID'] == qrel['qID']]['Query'].iloc[0]),
-        axis=1)
-    features['words_difference'] = features.progress_apply(
-        lambda qrel: difference(qrel['words_doc'], qrel['words_query']),
-        axis=1)
-    features['words_rel_difference'] = features.progress_apply(
-        lambda qrel: relative_difference(qrel['words_doc'], qrel['words_query']),
-        axis=1)
-
-    features['char_doc'] = features.progress_apply(
-        lambda qrel: characters(collection[collection['pID'] == qrel['pID']]['Passage'].iloc[0]),
-        axis=1)
-    features['char_query'] = features.progress_apply(
-        lambda qrel: characters(queries[queries['qID'] == qrel['qID']]['Query'].iloc[0]),
-        axis=1)
-    features['char_difference'] = features.progress_apply(
-        lambda qrel: difference(qrel['char_doc'], qrel['char_query']),
-        axis=1)
-    features['char_rel_difference'] = features.progress_apply(
-        lambda qrel: relative_difference(qrel['char_doc'], qrel['char_query']),
-        axis=1)
+    query_positions, passage_positions = index_pairs(features, collection, queries) if positions is None \
+        else positions
+    doc = create_entity_features(collection['Passage'], passage_positions,
+                                 lambda passage: (words(passage), characters(passage)), ['words', 'char'])
+    query = create_entity_features(queries['Query'], query_positions,
+                                   lambda query: (words(query), characters(query)), ['words', 'char'])
+
+    features['words_doc'] = doc['words'].values
+    features['words_query'] = query['words'].values
+    features['words_difference'] = difference(features['words_doc'], features['words_query'])
+    features['words_rel_difference'] = relative_difference(features['words_doc'], features['words_query'])
+
+    features['char_doc'] = doc['char'].values
+    features['char_query'] = query['char'].values
+    features['char_difference'] = difference(features['char_doc'], features['char_query'])
+    features['char_rel_difference'] = relative_difference(features['char_doc'], features['char_query'])
 
     return features
 
 
-def create_interpretation_features(features: pd.DataFrame, collection: pd.DataFrame, queries: pd.DataFrame):
+def create_interpretation_features(features: pd.DataFrame, collection: pd.DataFrame, queries: pd.DataFrame,
+                                   positions: tuple = None):
     """ Creates interpretation features for query and collection data (subjectivity, polarity)
 
     Args:
         features (pd.DataFrame): Dataframe containing feature data
         collection (pd.DataFrame): Dataframe containing collection data
         queries (pd.DataFrame): Dataframe containing queries data
+        positions (tuple): Row positions from index_pairs, created if None
 
     Returns:
         features (pd.DataFrame): Dataframe "features" with new columns "subjectivity_doc", "polarity_doc", "subjectivity_query", "polarity_query" appended
 
     """
-    features['subjectivity_doc'] = features.progress_apply(
-        lambda qrel: subjectivity(collection[collection['pID'] == qrel['pID']]['Passage'].iloc[0]),
-        axis=1)
-    features['polarity_doc'] = features.progress_apply(
-        lambda qrel: polarisation(collection[collection['pID'] == qrel['pID']]['Passage'].iloc[0]),
-        axis=1)
-
-    features['subjectivity_query'] = features.progress_apply(
-        lambda qrel: subjectivity(queries[queries['qID'] == qrel['qID']]['Query'].iloc[0]),
-        axis=1)
-    features['polarity_query'] = features.progress_apply(
-        lambda qrel: polarisation(queries[queries['qID'] == qrel['qID']]['Query'].iloc[0]),
-        axis=1)
+    query_positions, passage_positions = index_pairs(features, collection, queries) if positions is None \
+        else positions
+    doc = create_entity_features(collection['Passage'], passage_positions,
+                                 lambda passage: (subjectivity(passage), polarisation(passage)),
+                                 ['subjectivity', 'polarity'])
+    query = create_entity_features(queries['Query'], query_positions,
+                                   lambda query: (subjectivity(query), polarisation(query)),
+                                   ['subjectivity', 'polarity'])
+
+    features['subjectivity_doc'] = doc['subjectivity'].values
+    features['polarity_doc'] = doc['polarity'].values
+
+    features['subjectivity_query'] = query['subjectivity'].values
+    features['polarity_query'] = query['polarity'].values
 
     return features
 
 
-def create_POS_features(features: pd.DataFrame, collection: pd.DataFrame, queries: pd.DataFrame):
+def create_POS_features(features: pd.DataFrame, collection: pd.DataFrame, queries: pd.DataFrame,
+                        positions: tuple = None):
     """ Creates Part of Speech features for query and collection data (nouns, adjectives, verbs)
 
     Args:
         features (pd.DataFrame): Dataframe containing feature data
         collection (pd.DataFrame): Dataframe containing collection data
         queries (pd.DataFrame): Dataframe containing queries data
+        positions (tuple): Row positions from index_pairs, created if None
 
     Returns:
         features (pd.DataFrame): Dataframe "features" with new columns "doc_nouns", "doc_adjectives", "doc_verbs", "query_nouns",
         "query_adjectives", "query_verbs" appended
 
     """
-    pos = features.progress_apply(
-        lambda qrel: POS(collection[collection['pID'] == qrel['pID']]['Passage'].iloc[0]),
-        axis=1)
-    features['doc_nouns'] = [tag[0] for tag in pos]
-    features['doc_adjectives'] = [tag[1] for tag in pos]
-    features['doc_verbs'] = [tag[2] for tag in pos]
-
-    pos = features.progress_apply(
-        lambda qrel: POS(queries[queries['qID'] == qrel['qID']]['Query'].iloc[0]),
-        axis=1)
-    features['query_nouns'] = [tag[0] for tag in pos]
-    features['query_adjectives'] = [tag[1] for tag in pos]
-    features['query_verbs'] = [tag[2] for tag in pos]
+    query_positions, passage_positions = index_pairs(features, collection, queries) if positions is None \
+        else positions
+
+    pos = create_entity_features(collection['Passage'], passage_positions, POS, ['nouns', 'adjectives', 'verbs'])
+    features['doc_nouns'] = pos['nouns'].values
+    features['doc_adjectives'] = pos['adjectives'].values
+    features['doc_verbs'] = pos['verbs'].values
+
+    pos = create_entity_features(queries['Query'], query_positions, POS, ['nouns', 'adjectives', 'verbs'])
+    features['query_nouns'] = pos['nouns'].values
+    features['query_adjectives'] = pos['adjectives'].values
+    features['query_verbs'] = pos['verbs'].values
 
     return features
 
 
-def create_BM2_feature(features: pd.DataFrame, collection: pd.DataFrame, queries: pd.DataFrame):
+def create_entity_features(data: pd.Series, positions, function, columns: list):
+    """ Computes features of single passages or queries once per distinct entity and joins them onto the pairs.
+
+    Args:
+        data (pd.Series): Series containing passages or queries
+        positions (np.array): Row positions into data, one per query-collection combination
+        function (callable): Returns the feature values for one entry of data as tuple
+        columns (list): Names of the feature values returned by function
+
+    Returns:
+        (pd.DataFrame): Dataframe with one row per position and the given columns
+
+    """
+    unique, inverse = np.unique(positions, return_inverse=True)
+    values = data.values
+    table = pd.DataFrame([function(values[position]) for position in tqdm(unique)], columns=columns)
+
+    return table.iloc[inverse.ravel()].reset_index(drop=True)
+
+
+def create_BM2_feature(features: pd.DataFrame, collection: pd.DataFrame, queries: pd.DataFrame,
+                       positions: tuple = None):
     """ Creates BM25 features for query-collection combinations
 
     Args:
         features (pd.DataFrame): Dataframe containing feature data
         collection (pd.DataFrame): Dataframe containing collection data
         queries (pd.DataFrame): Dataframe containing queries data
+        positions (tuple): Row positions from index_pairs, created if None
 
     Returns:
         features (pd.DataFrame): Dataframe "features" with new column "bm25" appended
 
     """
+    query_positions, passage_positions = index_pairs(features, collection, queries) if positions is None \
+        else positions
+
     bm25 = BM25().fit(collection['preprocessed'])
-    features['bm25'] = features.progress_apply(
-        lambda qrel: bm25.predict_proba(queries[queries['qID'] == qrel['qID']]['preprocessed'].iloc[0],
-                                        collection[collection['pID'] == qrel['pID']]['preprocessed'].iloc[0]),
-        axis=1)
+    features['bm25'] = bm25.score_pairs(queries['preprocessed'], query_positions, passage_positions)
 
     return features
@@ -0,0 +1,56 @@
+import pandas as pd
+import numpy as np
+from tqdm import tqdm
+import logging
+from src.features.bm25 import BM25
+
+LOGGER = logging.getLogger('retrieval')
+
+
+def create_candidates(queries: pd.DataFrame, collection: pd.DataFrame, top_n: int = 1000, retriever=None,
+                      column='preprocessed'):
+    """ Creates the query-collection combinations to re-rank by retrieving the top_n passages per query.
+
+    A retriever may return fewer passages, BM25 returns none for a query sharing no term with the collection. Such
+    queries are filled up with the first passages of the collection not retrieved yet, so every query keeps
+    top_n candidates and stays part of the evaluation.
+
+    Args:
+        queries (pd.DataFrame): Dataframe containing query data
+        collection (pd.DataFrame): Dataframe containing collection data
+        top_n (int): Number of candidates per query, every passage of the collection is a candidate if None
+        retriever (object): Object with a search(query, k) method returning row positions of the collection,
+            BM25 fitted on the preprocessed collection if None
+        column (str or list): Column of queries passed to the retriever, a list of columns passes a tuple of
+            their values per query, e.g. to a FusionRetriever
+
+    Returns:
+        candidates (pd.DataFrame): Dataframe containing columns "qID" and "pID", best candidates first per query
+
+    """
+    if top_n is None:
+        return pd.DataFrame({
+            'qID': np.repeat(queries['qID'].values, len(collection)),
+            'pID': np.tile(collection['pID'].values, len(queries))
+        })
+
+    if retriever is None:
+        retriever = BM25().fit(collection['preprocessed'])
+
+    LOGGER.info(f'Retrieving {top_n} candidates for {len(queries)} queries')
+    inputs = queries[column] if isinstance(column, str) else list(zip(*[queries[name] for name in column]))
+    positions = [np.asarray(retriever.search(query, top_n)[0], dtype=np.int64) for query in tqdm(inputs)]
+
+    size = min(top_n, len(collection))
+    empty = sum(len(position) == 0 for position in positions)
+    if empty > 0:
+        LOGGER.warning(f'{empty} of {len(queries)} queries without retrieved candidates, filling them up with '
+                       f'passages of the collection')
+    positions = [position if len(position) >= size else np.concatenate([position, np.setdiff1d(
+        np.arange(size + len(position)), position)[:size - len(position)]]) for position in positions]
+    counts = [len(position) for position in positions]
+
+    return pd.DataFrame({
+        'qID': np.repeat(queries['qID'].values, counts),
+        'pID': collection['pID'].values[np.concatenate(positions) if len(positions) > 0 else []]
+    })
@@ -1,14 +1,21 @@
 from src.data.dataset import import_val_test_queries, import_queries, import_collection, import_qrels, \
-    import_training_set
+    import_training_set, download_dataset
 import pandas as pd
 from tqdm import tqdm
-from src.data.preprocessing import preprocess
+from src.data.preprocessing import preprocess, STEM_CACHE
+from src.data.vocabulary import Vocabulary
 from src.features.generator import create_bert_embeddings, create_bert_feature, create_glove_embeddings_tf_idf_weighted, \
     create_glove_feature, \
     create_glove_embeddings, create_w2v_embeddings, create_w2v_embeddings_tf_idf_weighted, create_w2v_feature, \
     create_tfidf_embeddings, create_all, \
     create_BM2_feature, create_tfidf_feature, create_jaccard_feature, create_POS_features, \
     create_interpretation_features, create_sentence_features, create_w2v_tfidf_feature
+from src.features.retrieval import create_candidates
+from src.features.bm25 import BM25
+from src.features.dense import DenseIndex
+from src.features.fusion import FusionRetriever
+from src.embeddings.bert import Bert
+import numpy as np
 import logging
 import os
 from src.models.training import Evaluation
@@ -21,12 +28,41 @@ from sklearn.ensemble import RandomForestClassifier, AdaBoostClassifier, Gradien
 from sklearn.dummy import DummyClassifier
 from src.models.ranknet import RankNet
 import torch
-from src.utils.utils import check_path_exists
+from src.utils.utils import check_path_exists, save, load, save_frame, load_frame
 
 tqdm.pandas()
 LOGGER = logging.getLogger('pipeline')
 
 
+class _LazyData(object):
+    """ Data frame attribute of the pipeline loaded from its source on first access.
+
+    Attributes:
+        default (callable): Returns the value of the attribute if no source is given
+    """
+
+    def __init__(self, default=None):
+        self.default = default
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, pipeline, owner):
+        if pipeline is None:
+            return self
+        if self.name not in pipeline.__dict__:
+            if self.name in pipeline.sources:
+                LOGGER.info(f'Loading {self.name}')
+                pipeline.__dict__[self.name] = pipeline._read(*pipeline.sources[self.name])
+            else:
+                pipeline.__dict__[self.name] = self.default() if self.default is not None else None
+        return pipeline.__dict__[self.name]
+
+    def __set__(self, pipeline, value):
+        pipeline.sources.pop(self.name, None)
+        pipeline.__dict__[self.name] = value
+
+
 class Pipeline(object):
     """ Class to combine the different download, preprocessing, modeling and evaluation steps. 
 
@@ -40,57 +76,93 @@ class Pipeline(object):
         qrels_test (str): Imports qrels_test data from .pkl file if not None
         features_test (pd.DataFrame): Imports features_test data from .pkl file if not None
         features_val (pd.DataFrame): Imports features_val data from .pkl file if not None
+        retrievers (dict): First-stage retrievers creating validation and test candidates, fitted on first use
+        vocabulary (Vocabulary): Vocabulary the preprocessed tokens are encoded with, None if not encoded
+        sources (dict): Path and columns of every data frame not loaded yet or loaded unchanged from disk
     """
 
-    collection = None
-    queries = None
-    queries_val = None
-    queries_test = None
-    qrels_val = None
-    qrels_test = None
-    features = pd.DataFrame()
-    features_test = pd.DataFrame()
-    features_val = pd.DataFrame()
+    collection = _LazyData()
+    queries = _LazyData()
+    queries_val = _LazyData()
+    queries_test = _LazyData()
+    qrels_val = _LazyData()
+    qrels_test = _LazyData()
+    features = _LazyData(pd.DataFrame)
+    features_test = _LazyData(pd.DataFrame)
+    features_val = _LazyData(pd.DataFrame)
+    retrievers = None
+    vocabulary = None
 
     def __init__(self, collection: str = None, queries: str = None, queries_val: str = None, queries_test: str = None,
                  features: str = None, qrels_val: str = None, qrels_test: str = None, features_test: str = None,
-                 features_val: str = None):
+                 features_val: str = None, vocabulary: str = None, columns: dict = None):
         """ Constructs pipeline object with all necessary attributes.
 
+        Data frames are loaded from .pkl files or from directories written by save on first access of their
+        attribute, see release to free them again.
+
         Args:
-            collection (str): Imports collection data from .pkl file if not None
-            queries (str): Imports queries data from .pkl file if not None
-            queries_val (str): Imports queries_val data from .pkl file if not None
-            queries_test (str): Imports queries_test data from .pkl file if not None
-            features (str): Imports features data from .pkl file if not None
-            qrels_val (str): Imports qrels_val data from .pkl file if not None
-            qrels_test (str): Imports qrels_test data from .pkl file if not None
-            features_test (str): Imports features_test data from .pkl file if not None
-            features_val (str): Imports features_val data from .pkl file if not None
+            collection (str): Imports collection data from .pkl file or directory if not None
+            queries (str): Imports queries data from .pkl file or directory if not None
+            queries_val (str): Imports queries_val data from .pkl file or directory if not None
+            queries_test (str): Imports queries_test data from .pkl file or directory if not None
+            features (str): Imports features data from .pkl file or directory if not None
+            qrels_val (str): Imports qrels_val data from .pkl file or directory if not None
+            qrels_test (str): Imports qrels_test data from .pkl file or directory if not None
+            features_test (str): Imports features_test data from .pkl file or directory if not None
+            features_val (str): Imports features_val data from .pkl file or directory if not None
+            vocabulary (str): Imports vocabulary from .pkl file if not None
+            columns (dict): Columns to load per attribute from directories, e.g. {"features": ["qID", "pID"]},
+                all columns of attributes not contained are loaded
 
         """
-        if qrels_val is not None:
-            self.qrels_val = pd.read_pickle(qrels_val)
-        if qrels_test is not None:
-            self.qrels_test = pd.read_pickle(qrels_test)
-        if collection is not None:
-            self.collection = pd.read_pickle(collection)
-        if queries is not None:
-            self.queries = pd.read_pickle(queries)
-        if queries_val is not None:
-            self.queries_val = pd.read_pickle(queries_val)
-        if queries_test is not None:
-            self.queries_test = pd.read_pickle(queries_test)
-        if features is not None:
-            self.features = pd.read_pickle(features)
-        if features_test is not None:
-            self.features_test = pd.read_pickle(features_test)
-        if features_val is not None:
-            self.features_val = pd.read_pickle(features_val)
+        columns = {} if columns is None else columns
+        paths = {'collection': collection, 'queries': queries, 'queries_val': queries_val,
+                 'queries_test': queries_test, 'features': features, 'qrels_val': qrels_val,
+                 'qrels_test': qrels_test, 'features_test': features_test, 'features_val': features_val}
+        self.sources = {name: (path, columns.get(name)) for name, path in paths.items() if path is not None}
+
+        if vocabulary is not None:
+            self.vocabulary = load(vocabulary)
+
+    def release(self, *names: str):
+        """ Frees loaded data frames. Data frames with a source are loaded again on their next access, changes
+        not saved are lost.
+
+        Args:
+            names (str): Attributes to release, e.g. "collection", all data frames if none given
+
+        Returns:
+            none
+
+        """
+        if len(names) == 0:
+            names = [name for name, value in vars(Pipeline).items() if isinstance(value, _LazyData)]
+
+        for name in names:
+            assert isinstance(vars(Pipeline).get(name), _LazyData), f'{name} is no data frame of the pipeline'
+            self.__dict__.pop(name, None)
+
+        return self
+
+    @staticmethod
+    def _read(path: str, columns: list = None):
+        """ Loads a data frame from a directory written by save_frame or from a .pkl file.
+
+        A missing "<name>.pkl" falls back to the directory "<name>" written by save.
+        """
+        if not os.path.exists(path) and path.endswith('.pkl') and os.path.isdir(path[:-len('.pkl')]):
+            path = path[:-len('.pkl')]
+        if os.path.isdir(path):
+            return load_frame(path, columns)
+
+        data = pd.read_pickle(path)
+        return data if columns is None else data[columns]
 
     def setup(self, qrel_sampling: int = 20, training_sampling: int = 200, irrelevant_sampling: int = 0,
               datasets: list = None, path: str = 'data/TREC_Passage'):
-        """ Samples from the different datasets and initializes pipeline.
+        """ Samples from the different datasets and initializes pipeline. Missing datasets are downloaded concurrently
+        up front.
 
         Args:
             qrel_sampling (int): Specifies number samples from "2019qrels-pass.txt"
@@ -107,6 +179,8 @@ class Pipeline(object):
             datasets = ['collection.tsv', 'queries.train.tsv', 'msmarco-test2019-queries.tsv', '2019qrels-pass.txt',
                         '2020qrels-pass.txt', 'qidpidtriples.train.full.2.tsv', 'msmarco-test2020-queries.tsv']
 
+        download_dataset(datasets, path, extract=False)
+
         if '2019qrels-pass.txt' or '2019qrels-pass.txt' in datasets:
             self.qrels_val, self.qrels_test = import_qrels(path, qrel_sampling)
         if 'msmarco-test2019-queries.tsv' or 'msmarco-test2020-queries.tsv' in datasets:
@@ -127,27 +201,44 @@ class Pipeline(object):
 
         return self
 
-    def preprocess(self, expansion=False):
+    def preprocess(self, expansion=False, workers: int = 1, stem_cache: str = 'data/processed/stem_cache.pkl',
+                   vocabulary: bool = False):
         """ Preprocesses the data.
 
         Args:
             expansion (bool): Whether query expansion should be used
+            workers (int): Number of processes used for preprocessing, all cores if None
+            stem_cache (str): Path to load the stem cache from and store it to, not persisted if None
+            vocabulary (bool): Whether the preprocessed tokens should be encoded as int32 token ids
 
         Returns:
             none
 
         """
+        if stem_cache is not None:
+            STEM_CACHE.load(stem_cache)
+
         LOGGER.info('Preprocessing collection')
-        self.collection['preprocessed'] = preprocess(self.collection.Passage)
+        self.collection['preprocessed'] = preprocess(self.collection.Passage, workers=workers)
 
         LOGGER.info('Preprocessing queries')
-        self.queries['preprocessed'] = preprocess(self.queries.Query, expansion)
+        self.queries['preprocessed'] = preprocess(self.queries.Query, expansion, workers=workers)
 
         LOGGER.info('Preprocessing validation queries')
-        self.queries_val['preprocessed'] = preprocess(self.queries_val.Query, expansion)
+        self.queries_val['preprocessed'] = preprocess(self.queries_val.Query, expansion, workers=workers)
 
         LOGGER.info('Preprocessing test queries')
-        self.queries_test['preprocessed'] = preprocess(self.queries_test.Query, expansion)
+        self.queries_test['preprocessed'] = preprocess(self.queries_test.Query, expansion, workers=workers)
+
+        LOGGER.info(f'Stem cache: {STEM_CACHE.statistics()}')
+        if stem_cache is not None:
+            STEM_CACHE.save(stem_cache)
+
+        if vocabulary:
+            LOGGER.info('Encoding preprocessed tokens')
+            self.vocabulary = Vocabulary()
+            for data in [self.collection, self.queries, self.queries_val, self.queries_test]:
+                data['preprocessed'] = self.vocabulary.encode(data['preprocessed']).to_series(data.index)
 
         return self
 
@@ -166,10 +257,8 @@ class Pipeline(object):
         """ Creates word2vec embeddings tfidf-weighted. """
 
         assert self.collection['preprocessed'] is not None, "Preprocess the data first"
-        assert self.collection['tfidf'] is not None, "Create tfidf first!"
-        assert self.queries['tfidf'] is not None, "Create tfidf first!"
-        assert self.queries_val['tfidf'] is not None, "Create tfidf first!"
-        assert self.queries_test['tfidf'] is not None, "Create tfidf first!"
+        for name in ['collection', 'query', 'query_val', 'query_test']:
+            assert os.path.exists(f'data/embeddings/tfidf_{name}_embeddings'), "Create tfidf first!"
 
         w2v, self.collection = create_w2v_embeddings_tf_idf_weighted(self.collection, name='collection')
         w2v, self.queries = create_w2v_embeddings_tf_idf_weighted(self.queries, w2v=w2v, name='query')
@@ -190,13 +279,13 @@ class Pipeline(object):
 
         return self
 
-    def create_w2v_feature(self, path_collection: str = 'data/embeddings/w2v_collection_embeddings.pkl',
-                           path_query: str = 'data/embeddings/w2v_query_embeddings.pkl'):
+    def create_w2v_feature(self, path_collection: str = 'data/embeddings/w2v_collection_embeddings',
+                           path_query: str = 'data/embeddings/w2v_query_embeddings'):
         """ Creates word2vec features.
 
         Args:
-            path_collection (str): Path to "w2v_collection_embeddings.pkl"
-            path_query (str): Path to "w2v_collection_embeddings.pkl"
+            path_collection (str): Path to "w2v_collection_embeddings" directory
+            path_query (str): Path to "w2v_collection_embeddings" directory
 
         Returns:
             none
@@ -210,13 +299,13 @@ class Pipeline(object):
 
         return self
 
-    def create_w2v_tfidf_feature(self, path_collection: str = 'data/embeddings/w2v_tfidf_collection_embeddings.pkl',
-                                 path_query: str = 'data/embeddings/w2v_tfidf_query_embeddings.pkl'):
+    def create_w2v_tfidf_feature(self, path_collection: str = 'data/embeddings/w2v_tfidf_collection_embeddings',
+                                 path_query: str = 'data/embeddings/w2v_tfidf_query_embeddings'):
         """ Creates word2vec tfidf-weighted features.
 
         Args:
-            path_collection (str): Path to "w2v_tfidf_collection_embeddings.pkl"
-            path_query (str): Path to "w2v_tfidf_query_embeddings.pkl"
+            path_collection (str): Path to "w2v_tfidf_collection_embeddings" directory
+            path_query (str): Path to "w2v_tfidf_query_embeddings" directory
 
         Returns:
             none
@@ -243,10 +332,14 @@ class Pipeline(object):
         """ Creates glove embeddings. """
         assert self.collection['preprocessed'] is not None, "Preprocess the data first"
 
-        glove, self.collection = create_glove_embeddings(self.collection, name='collection')
-        glove, self.queries = create_glove_embeddings(self.queries, glove=glove, name='query')
-        glove, self.queries_val = create_glove_embeddings(self.queries_val, glove=glove, name='query_val')
-        glove, self.queries_test = create_glove_embeddings(self.queries_test, glove=glove, name='query_test')
+        glove, self.collection = create_glove_embeddings(self.collection, name='collection',
+                                                         vocabulary=self.vocabulary)
+        glove, self.queries = create_glove_embeddings(self.queries, glove=glove, name='query',
+                                                      vocabulary=self.vocabulary)
+        glove, self.queries_val = create_glove_embeddings(self.queries_val, glove=glove, name='query_val',
+                                                          vocabulary=self.vocabulary)
+        glove, self.queries_test = create_glove_embeddings(self.queries_test, glove=glove, name='query_test',
+                                                           vocabulary=self.vocabulary)
 
         return self
 
@@ -259,13 +352,13 @@ class Pipeline(object):
         glove, self.collection = create_glove_embeddings_tf_idf_weighted(self.collection, name='collection')
         return self.save()
 
-    def create_tfidf_feature(self, path_collection: str = 'data/embeddings/tfidf_collection_embeddings.pkl',
-                             path_query: str = 'data/embeddings/tfidf_query_embeddings.pkl'):
+    def create_tfidf_feature(self, path_collection: str = 'data/embeddings/tfidf_collection_embeddings',
+                             path_query: str = 'data/embeddings/tfidf_query_embeddings'):
         """ Creates tfidf-features.
 
         Args:
-            path_collection (str): Path to "tfidf_collection_embeddings.pkl"
-            path_query (str): Path to "tfidf_query_embeddings.pkl"
+            path_collection (str): Path to "tfidf_collection_embeddings" directory
+            path_query (str): Path to "tfidf_query_embeddings" directory
 
         Returns:
             none
@@ -279,13 +372,13 @@ class Pipeline(object):
 
         return self
 
-    def create_bert_feature(self, path_collection: str = 'data/embeddings/bert_collection_embeddings.pkl',
-                            path_query: str = 'data/embeddings/bert_query_embeddings.pkl'):
+    def create_bert_feature(self, path_collection: str = 'data/embeddings/bert_collection_embeddings',
+                            path_query: str = 'data/embeddings/bert_query_embeddings'):
         """ Creates bert features.
 
         Args:
-            path_collection (str): Path to "bert_collection_embeddings.pkl"
-            path_query (str): Path to "bert_query_embeddings.pkl"
+            path_collection (str): Path to "bert_collection_embeddings" directory
+            path_query (str): Path to "bert_query_embeddings" directory
 
         Returns:
             none
@@ -298,13 +391,13 @@ class Pipeline(object):
                                                 self.queries, path_collection, path_query)
         return self
 
-    def create_glove_feature(self, path_collection: str = 'data/embeddings/glove_collection_embeddings.pkl',
-                             path_query: str = 'data/embeddings/glove_query_embeddings.pkl'):
+    def create_glove_feature(self, path_collection: str = 'data/embeddings/glove_collection_embeddings',
+                             path_query: str = 'data/embeddings/glove_query_embeddings'):
         """ Creates glove features.
 
         Args:
-            path_collection (str): Path to "glove_collection_embeddings.pkl"
-            path_query (str): Path to "glove_query_embeddings.pkl"
+            path_collection (str): Path to "glove_collection_embeddings" directory
+            path_query (str): Path to "glove_query_embeddings" directory
 
         Returns:
             none
@@ -358,29 +451,91 @@ class Pipeline(object):
 
     def create_train_features(self):
         """ Creates features for the training data. """
-        self.features = create_all(self.features, self.collection, self.queries)
-        self.features_test = create_all(self.features_test, self.collection, self.queries)
-        self.features_val = create_all(self.features_val, self.collection, self.queries)
+        self.features = create_all(self.features, self.collection, self.queries, vocabulary=self.vocabulary)
+        self.features_test = create_all(self.features_test, self.collection, self.queries,
+                                        vocabulary=self.vocabulary)
+        self.features_val = create_all(self.features_val, self.collection, self.queries, vocabulary=self.vocabulary)
 
         return self
 
-    def create_test_features(self):
-        """ Creates features for test data. """
-        for index, query in self.queries_test.iterrows():
-            self.features_test = pd.concat([self.features_test, pd.DataFrame({
-                'qID': [query['qID']] * len(self.collection),
-                'pID': self.collection['pID']
-            })])
-        self.features_test = create_all(self.features_test, self.collection, self.queries_test)
-
-    def create_val_features(self):
-        """ Creates features for validation data. """
-        for index, query in self.queries_val.iterrows():
-            self.features_val = pd.concat([self.features_val, pd.DataFrame({
-                'qID': [query['qID']] * len(self.collection),
-                'pID': self.collection['pID']
-            })])
-        self.features_val = create_all(self.features_val, self.collection, self.queries_val)
+    def create_retriever(self, retriever: str = 'bm25'):
+        """ Returns a first-stage retriever fitted on the collection, fitting it on first use.
+
+        Args:
+            retriever (str): "bm25" for BM25 on the preprocessed tokens, "dense" for an index over bert embeddings
+                or "hybrid" for the reciprocal rank fusion of both
+
+        Returns:
+            retriever (object): Object with a search(query, k) method returning row positions of the collection
+            column (str or list): Column of the queries passed to the retriever
+
+        """
+        columns = {'bm25': 'preprocessed', 'dense': 'Query', 'hybrid': ['preprocessed', 'Query']}
+        assert retriever in columns, f'Unknown retriever {retriever}'
+
+        if self.retrievers is None:
+            self.retrievers = {}
+        if retriever not in self.retrievers:
+            LOGGER.info(f'Fitting {retriever} retriever')
+            if retriever == 'bm25':
+                assert self.collection['preprocessed'] is not None, "Preprocess the data first"
+                self.retrievers[retriever] = BM25().fit(self.collection['preprocessed'])
+            elif retriever == 'hybrid':
+                self.retrievers[retriever] = FusionRetriever([self.create_retriever('bm25')[0],
+                                                              self.create_retriever('dense')[0]])
+            else:
+                bert = Bert()
+                embeddings = np.stack(self.collection['bert'].values) if 'bert' in self.collection.columns \
+                    else bert.transform(self.collection['Passage'])
+                self.retrievers[retriever] = DenseIndex(bert).fit(embeddings)
+
+        return self.retrievers[retriever], columns[retriever]
+
+    def create_candidates(self, queries: pd.DataFrame, top_n: int = 1000, retriever: str = 'bm25'):
+        """ Retrieves the top_n candidates per query from the collection.
+
+        Args:
+            queries (pd.DataFrame): Queries to retrieve candidates for
+            top_n (int): Number of candidates per query, every passage of the collection is a candidate if None
+            retriever (str): "bm25", "dense" or "hybrid", see create_retriever
+
+        Returns:
+            candidates (pd.DataFrame): Dataframe containing columns "qID" and "pID"
+
+        """
+        if top_n is None:
+            return create_candidates(queries, self.collection, top_n)
+
+        retriever, column = self.create_retriever(retriever)
+        return create_candidates(queries, self.collection, top_n, retriever, column)
+
+    def create_test_features(self, top_n: int = 1000, retriever: str = 'bm25'):
+        """ Creates features for test data.
+
+        Args:
+            top_n (int): Number of candidates per query, every passage of the collection is a candidate if None
+            retriever (str): First-stage retriever creating the candidates, "bm25", "dense" or "hybrid"
+
+        """
+        self.features_test = pd.concat([self.features_test,
+                                        self.create_candidates(self.queries_test, top_n, retriever)],
+                                       ignore_index=True)
+        self.features_test = create_all(self.features_test, self.collection, self.queries_test,
+                                        vocabulary=self.vocabulary)
+
+    def create_val_features(self, top_n: int = 1000, retriever: str = 'bm25'):
+        """ Creates features for validation data.
+
+        Args:
+            top_n (int): Number of candidates per query, every passage of the collection is a candidate if None
+            retriever (str): First-stage retriever creating the candidates, "bm25", "dense" or "hybrid"
+
+        """
+        self.features_val = pd.concat([self.features_val,
+                                       self.create_candidates(self.queries_val, top_n, retriever)],
+                                      ignore_index=True)
+        self.features_val = create_all(self.features_val, self.collection, self.queries_val,
+                                       vocabulary=self.vocabulary)
 
     def evaluate(self, name: str = None, model: str = 'nb', pca: int = 0,
                  pairwise_model: str = None, pairwise_top_k: int = 50, search_space: list = None, trials: int = 20,
@@ -479,7 +634,7 @@ class Pipeline(object):
                                             50, pca, name=name)
 
     def save(self, name: str, path: str = 'data/processed'):
-        """ Saves created DataFrames as .pkl files.
+        """ Saves created DataFrames column by column to directories, see save_frame.
 
         Args:
             name (str): Specify name of dataset
@@ -492,14 +647,16 @@ class Pipeline(object):
         assert name is not None, 'Please provide experiment name'
 
         check_path_exists(path)
-        self.queries.to_pickle(os.path.join(path, name + '_queries.pkl'))
-        self.queries_test.to_pickle(os.path.join(path, name + '_queries_test.pkl'))
-        self.queries_val.to_pickle(os.path.join(path, name + '_queries_val.pkl'))
-        self.collection.to_pickle(os.path.join(path, name + '_collection.pkl'))
-        self.features.to_pickle(os.path.join(path, name + '_features.pkl'))
-        self.qrels_test.to_pickle(os.path.join(path, name + '_qrels_test.pkl'))
-        self.qrels_val.to_pickle(os.path.join(path, name + '_qrels_val.pkl'))
-        self.features_test.to_pickle(os.path.join(path, name + '_features_test.pkl'))
-        self.features_val.to_pickle(os.path.join(path, name + '_features_val.pkl'))
+        save_frame(self.queries, os.path.join(path, name + '_queries'))
+        save_frame(self.queries_test, os.path.join(path, name + '_queries_test'))
+        save_frame(self.queries_val, os.path.join(path, name + '_queries_val'))
+        save_frame(self.collection, os.path.join(path, name + '_collection'))
+        save_frame(self.features, os.path.join(path, name + '_features'))
+        save_frame(self.qrels_test, os.path.join(path, name + '_qrels_test'))
+        save_frame(self.qrels_val, os.path.join(path, name + '_qrels_val'))
+        save_frame(self.features_test, os.path.join(path, name + '_features_test'))
+        save_frame(self.features_val, os.path.join(path, name + '_features_val'))
+        if self.vocabulary is not None:
+            save(self.vocabulary, os.path.join(path, name + '_vocabulary.pkl'))
 
         return self
@@ -1,6 +1,11 @@
 import os
+import json
+import shutil
 import logging
 import dill as pickle
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
 
 LOGGER = logging.getLogger('utils')
 
@@ -59,3 +64,208 @@ def load(path: str):
 
     """
     return pickle.load(open(path, "rb"))
+
+
+def save_embeddings(embeddings, path: str, ids: list = None, dtype=np.float32):
+    """ Saves embeddings as memory-mappable .npy files in a directory.
+
+    Dense embeddings are stored as one contiguous matrix "embeddings.npy", sparse embeddings as the
+    "data.npy", "indices.npy", "indptr.npy" and "shape.npy" arrays of a CSR matrix.
+    The IDs of the rows are stored as "ids.npy" if given.
+
+    Args:
+        embeddings (list): List of embeddings, matrix or sparse matrix containing one embedding per row
+        path (str): The directory to store the embeddings to
+        ids (list): ID of every row
+        dtype (np.dtype): Data type of the stored dense embeddings, e.g. np.float32 or np.float16
+
+    Returns:
+        path (str): The path the embeddings have been stored to
+
+    """
+    check_path_exists(path)
+
+    if sp.issparse(embeddings):
+        embeddings = embeddings.tocsr()
+        for name in ['data', 'indices', 'indptr']:
+            np.save(os.path.join(path, f'{name}.npy'), getattr(embeddings, name))
+        np.save(os.path.join(path, 'shape.npy'), np.array(embeddings.shape))
+    else:
+        dimension = len(embeddings[0]) if len(embeddings) > 0 else 0
+        matrix = np.lib.format.open_memmap(os.path.join(path, 'embeddings.npy'), mode='w+', dtype=dtype,
+                                           shape=(len(embeddings), dimension))
+        if isinstance(embeddings, np.ndarray):
+            matrix[:] = embeddings
+        else:
+            for i, embedding in enumerate(embeddings):
+                matrix[i] = embedding
+        matrix.flush()
+        del matrix
+
+    if ids is not None:
+        np.save(os.path.join(path, 'ids.npy'), np.asarray(ids))
+
+    return path
+
+
+def load_embeddings(path: str):
+    """ Loads embeddings stored by save_embeddings memory-mapped, or embeddings pickled by save.
+
+    Args:
+        path (str): The directory or pickle file to load the embeddings from
+
+    Returns:
+        (np.array): Read-only memory-mapped matrix, sparse matrix or matrix loaded from a pickle
+
+    """
+    if not os.path.isdir(path):
+        embeddings = load(path)
+        return embeddings if sp.issparse(embeddings) else np.array(embeddings)
+
+    if os.path.exists(os.path.join(path, 'embeddings.npy')):
+        return np.load(os.path.join(path, 'embeddings.npy'), mmap_mode='r')
+
+    data, indices, indptr = [np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+                             for name in ['data', 'indices', 'indptr']]
+    return sp.csr_matrix((data, indices, indptr), shape=tuple(np.load(os.path.join(path, 'shape.npy'))),
+                         copy=False)
+
+
+def load_embedding_ids(path: str):
+    """ Loads the IDs of the rows of embeddings stored by save_embeddings.
+
+    Args:
+        path (str): The directory the embeddings have been stored to
+
+    Returns:
+        (np.array): ID of every row, None if no IDs have been stored
+
+    """
+    ids_path = os.path.join(path, 'ids.npy')
+    return np.load(ids_path, allow_pickle=True) if os.path.exists(ids_path) else None
+
+
+def save_frame(data: pd.DataFrame, path: str):
+    """ Saves a data frame column by column to a directory, so single columns can be loaded memory-mapped.
+
+    Numeric columns are stored as .npy arrays, columns of equally long numeric arrays (embeddings) as matrices
+    in the format of save_embeddings and columns of numeric arrays of varying length (token ids) as their
+    concatenated values and offsets. All other columns and the index are pickled, columns of pandas extension
+    dtypes (category, Int64, boolean, ...) as their extension array to keep the dtype. "manifest.json" lists the
+    columns in order with their storage kind.
+
+    The directory is written next to the target and moved into place afterwards, so a data frame loaded
+    memory-mapped from path can be saved back to it.
+
+    Args:
+        data (pd.DataFrame): Data frame to store
+        path (str): The directory to store the data frame to
+
+    Returns:
+        path (str): The path the data frame has been stored to
+
+    """
+    path = os.path.normpath(path)
+    target, previous = path + '.tmp', path + '.old'
+    for directory in [target, previous]:
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+    check_path_exists(target)
+    manifest = {'rows': len(data), 'columns': []}
+
+    for i, name in enumerate(data.columns):
+        column, file = data[name], os.path.join(target, str(i))
+        kind = _column_kind(column)
+
+        if kind == 'array':
+            np.save(file + '.npy', column.to_numpy())
+        elif kind == 'matrix':
+            save_embeddings(list(column), file, dtype=column.iloc[0].dtype)
+        elif kind == 'ragged':
+            lengths = np.fromiter((len(value) for value in column), dtype=np.int64, count=len(column))
+            check_path_exists(file)
+            np.save(os.path.join(file, 'values.npy'), np.concatenate(list(column)))
+            np.save(os.path.join(file, 'offsets.npy'), np.concatenate([[0], np.cumsum(lengths)]))
+        elif isinstance(column.dtype, np.dtype):
+            save(column.to_numpy(), file + '.pkl')
+        else:
+            save(column.array, file + '.pkl')
+
+        manifest['columns'].append({'name': name, 'kind': kind, 'file': str(i)})
+
+    save(data.index, os.path.join(target, 'index.pkl'))
+    with open(os.path.join(target, 'manifest.json'), 'w') as file:
+        json.dump(manifest, file)
+
+    # os.replace cannot overwrite a non-empty directory, so the previous one is moved aside first. Its files
+    # stay readable through existing memory maps after removal.
+    if os.path.exists(path):
+        os.replace(path, previous)
+    os.replace(target, path)
+    if os.path.exists(previous):
+        shutil.rmtree(previous)
+
+    return path
+
+
+def load_frame(path: str, columns: list = None):
+    """ Loads the columns of a data frame stored by save_frame.
+
+    Numeric, matrix and token id columns are memory-mapped, the rows of the latter two are views into the
+    mapped files. Numeric columns are mapped copy-on-write, so they can be edited without touching the files.
+
+    Args:
+        path (str): The directory the data frame has been stored to
+        columns (list): Columns to load, all if None
+
+    Returns:
+        (pd.DataFrame): Data frame containing the requested columns
+
+    """
+    with open(os.path.join(path, 'manifest.json')) as file:
+        manifest = json.load(file)
+
+    stored = {entry['name']: entry for entry in manifest['columns']}
+    if columns is None:
+        columns = list(stored)
+    missing = [name for name in columns if name not in stored]
+    assert len(missing) == 0, f'Columns {missing} not stored in {path}'
+
+    index = load(os.path.join(path, 'index.pkl'))
+    data = {}
+    for name in columns:
+        kind, file = stored[name]['kind'], os.path.join(path, stored[name]['file'])
+
+        if kind == 'array':
+            data[name] = np.load(file + '.npy', mmap_mode='c')
+        elif kind == 'matrix':
+            data[name] = _object_array(list(load_embeddings(file)))
+        elif kind == 'ragged':
+            values = np.load(os.path.join(file, 'values.npy'), mmap_mode='r')
+            offsets = np.load(os.path.join(file, 'offsets.npy'))
+            data[name] = _object_array([values[start:end] for start, end in zip(offsets[:-1], offsets[1:])])
+        else:
+            data[name] = load(file + '.pkl')
+
+    return pd.DataFrame(data, index=index, columns=columns, copy=False)
+
+
+def _column_kind(column: pd.Series):
+    """ Returns how save_frame stores a column: "array", "matrix", "ragged" or "pickle". """
+    if column.dtype != object:
+        return 'array' if isinstance(column.dtype, np.dtype) and column.dtype.kind in 'biufcmM' else 'pickle'
+
+    if len(column) == 0 or not all(isinstance(value, np.ndarray) and value.ndim == 1 for value in column):
+        return 'pickle'
+    dtypes = {value.dtype for value in column}
+    if len(dtypes) > 1 or next(iter(dtypes)).kind not in 'biufc':
+        return 'pickle'
+
+    return 'matrix' if len({len(value) for value in column}) == 1 else 'ragged'
+
+
+def _object_array(values: list):
+    """ Returns an object array holding the given arrays as elements. """
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
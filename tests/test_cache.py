@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from src.embeddings.cache import EmbeddingCache
+
+
+class EmbeddingCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = EmbeddingCache(self.directory.name, max_chunks=3)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_hash_distinguishes_types(self):
+        inputs = [['a', 'b'], 'a\x1fb', [1, 2], ['1', '2'], np.array([1, 2], dtype=np.int32), ['ab'], ['a', 'b']]
+        keys = EmbeddingCache.hash(inputs)
+        self.assertEqual(len(set(keys[:4])), 4)
+        self.assertEqual(keys[2], keys[4])
+        self.assertNotEqual(keys[5], keys[0])
+        self.assertEqual(keys[6], keys[0])
+
+    def test_chunks_merged(self):
+        def transform(inputs):
+            return np.array([[len(entry), i] for i, entry in enumerate(inputs)], dtype=np.float32)
+
+        expected = {}
+        for i in range(5):
+            inputs = [f'text {i} {j}' for j in range(i + 1)]
+            for entry, row in zip(inputs, self.cache.transform('model', inputs, transform)):
+                expected[entry] = row
+
+        model, = os.listdir(self.directory.name)
+        self.assertLessEqual(len(self.cache._chunks(os.path.join(self.directory.name, model))), 3)
+
+        cached = self.cache.transform('model', list(expected), lambda inputs: self.fail('not cached'))
+        np.testing.assert_array_equal(cached, np.array(list(expected.values())))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import io
+import os
+import tarfile
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest import mock
+
+from src.data import dataset
+
+DATA = os.urandom(3000000)
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """ Serves DATA for every path and answers range requests like the MS MARCO blob storage. """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        requested = self.headers.get('Range')
+        if requested is None:
+            self.send_response(200)
+            body = DATA
+        else:
+            start = int(requested.split('=')[1].rstrip('-'))
+            if start >= len(DATA):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(DATA)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(DATA) - 1}/{len(DATA)}')
+            body = DATA[start:]
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class DownloadTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f'http://127.0.0.1:{cls.server.server_port}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+        self.file = os.path.join(self.path, 'file.bin')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_part(self, data: bytes):
+        with open(self.file + '.part', 'wb') as file:
+            file.write(data)
+
+    def read(self):
+        with open(self.file, 'rb') as file:
+            return file.read()
+
+    def test_download(self):
+        digest = dataset.download(f'{self.url}/file.bin', self.path)
+        self.assertEqual(self.read(), DATA)
+        self.assertEqual(digest, hashlib.sha256(DATA).hexdigest())
+        self.assertFalse(os.path.exists(self.file + '.part'))
+
+    def test_resume(self):
+        self.write_part(DATA[:1000000])
+        dataset.download(f'{self.url}/file.bin', self.path)
+        self.assertEqual(self.read(), DATA)
+
+    def test_complete_part(self):
+        self.write_part(DATA)
+        dataset.download(f'{self.url}/file.bin', self.path)
+        self.assertEqual(self.read(), DATA)
+
+    def test_oversized_part(self):
+        self.write_part(DATA + b'extra')
+        dataset.download(f'{self.url}/file.bin', self.path)
+        self.assertEqual(self.read(), DATA)
+
+    def test_checksum(self):
+        dataset.download(f'{self.url}/file.bin', self.path, checksum=hashlib.sha256(DATA).hexdigest())
+        self.assertEqual(self.read(), DATA)
+
+    def test_checksum_mismatch(self):
+        with self.assertRaises(IOError):
+            dataset.download(f'{self.url}/file.bin', self.path, checksum='0' * 64)
+        self.assertFalse(os.path.exists(self.file))
+        self.assertFalse(os.path.exists(self.file + '.part'))
+
+    def test_download_dataset(self):
+        links = {name: f'{self.url}/{name}' for name in ['2019qrels-pass.txt', '2020qrels-pass.txt']}
+        with mock.patch.dict(dataset.LINKS, links):
+            dataset.download_dataset(list(links), self.path, extract=False)
+
+        with open(os.path.join(self.path, 'checksums.json')) as file:
+            recorded = json.load(file)
+        for name in links:
+            with open(os.path.join(self.path, name), 'rb') as file:
+                self.assertEqual(file.read(), DATA)
+            self.assertEqual(recorded[name], hashlib.sha256(DATA).hexdigest())
+
+    def test_download_dataset_recorded_checksum(self):
+        with open(os.path.join(self.path, 'checksums.json'), 'w') as file:
+            json.dump({'2019qrels-pass.txt': '0' * 64}, file)
+
+        with mock.patch.dict(dataset.LINKS, {'2019qrels-pass.txt': f'{self.url}/2019qrels-pass.txt'}):
+            with self.assertRaises(IOError):
+                dataset.download_dataset(['2019qrels-pass.txt'], self.path, extract=False)
+
+
+class CollectionTest(unittest.TestCase):
+
+    LINES = ['7\tplain passage', '3\ta "quoted" passage', '5\t"starts with a quote', '9\tNA', '1\tlast']
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_index_matches_stream(self):
+        data = ('\n'.join(self.LINES) + '\n').encode('utf-8')
+        with tarfile.open(os.path.join(self.path, 'collection.tar.gz'), 'w:gz') as tar:
+            member = tarfile.TarInfo('collection.tsv')
+            member.size = len(data)
+            tar.addfile(member, io.BytesIO(data))
+
+        requested = dict(qrels_val=[9, 3], qrels_test=[5], triples=[1, 7])
+        streamed = dataset.import_collection(self.path, **requested)
+        with open(os.path.join(self.path, 'collection.tsv'), 'wb') as file:
+            file.write(data)
+        indexed = dataset.import_collection(self.path, **requested)
+
+        self.assertEqual(list(streamed['pID']), [7, 3, 5, 9, 1])
+        self.assertEqual(list(streamed['Passage']), [line.split('\t')[1] for line in self.LINES])
+        self.assertEqual(streamed.to_dict('list'), indexed.to_dict('list'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from src.utils.utils import save_frame, load_frame
+
+
+class FrameTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'frame')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_save_to_loaded_path(self):
+        data = pd.DataFrame({'score': np.arange(250000, dtype=np.float64),
+                             'embedding': [np.full(4, i, dtype=np.float32) for i in range(250000)],
+                             'tokens': [np.arange(i % 5, dtype=np.int64) for i in range(250000)]})
+        save_frame(data, self.path)
+
+        loaded = load_frame(self.path)
+        loaded['rank'] = np.arange(len(loaded))
+        save_frame(loaded, self.path)
+
+        stored = load_frame(self.path)
+        self.assertEqual(list(stored.columns), ['score', 'embedding', 'tokens', 'rank'])
+        np.testing.assert_array_equal(stored['score'], data['score'])
+        np.testing.assert_array_equal(stored['embedding'].iloc[-1], data['embedding'].iloc[-1])
+        np.testing.assert_array_equal(stored['tokens'].iloc[-1], data['tokens'].iloc[-1])
+        np.testing.assert_array_equal(stored['rank'], np.arange(len(data)))
+        self.assertEqual(os.listdir(self.directory.name), ['frame'])
+
+    def test_extension_dtypes(self):
+        data = pd.DataFrame({'label': pd.Categorical(['a', 'b', 'a'], categories=['b', 'a']),
+                             'count': pd.array([1, None, 3], dtype='Int64'),
+                             'relevant': pd.array([True, None, False], dtype='boolean'),
+                             'text': ['x', 'y', 'z']})
+        save_frame(data, self.path)
+
+        stored = load_frame(self.path)
+        pd.testing.assert_frame_equal(stored, data)
+
+
+if __name__ == '__main__':
+    unittest.main()